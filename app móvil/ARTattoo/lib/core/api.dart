@@ -237,10 +237,13 @@ class Api {
   /// - q.startsWith('@') => por nombre/email de artista
   /// - q normal          => por título/descr
   /// Si hay token, usa GET autenticado para obtener `is_favorited`.
-  static Future<List<Map<String, dynamic>>> getDesigns({int? artistId, String? q}) async {
+  /// El servidor pagina: cada respuesta trae a lo más una página y, si hay más,
+  /// el cursor de la siguiente en el header X-Next-Cursor.
+  static Future<DesignsPage> getDesignsPage({int? artistId, String? q, String? cursor}) async {
     final params = <String, String>{};
     if (artistId != null) params['artist_id'] = '$artistId';
     if (q != null && q.trim().isNotEmpty) params['q'] = q.trim();
+    if (cursor != null) params['cursor'] = cursor;
 
     final uri = Uri.parse('$base/designs')
         .replace(queryParameters: params.isEmpty ? null : params);
@@ -249,7 +252,23 @@ class Api {
     final r = (t == null || t.isEmpty) ? await http.get(uri) : await authedGet(uri);
 
     if (r.statusCode != 200) throw Exception('No se pudo cargar el catálogo');
-    return List<Map<String, dynamic>>.from(jsonDecode(r.body));
+    return DesignsPage(
+      List<Map<String, dynamic>>.from(jsonDecode(r.body)),
+      r.headers['x-next-cursor'],
+    );
+  }
+
+  /// Todas las páginas seguidas (listas acotadas, p. ej. el perfil de un artista).
+  /// El catálogo general pagina con getDesignsPage a medida que se hace scroll.
+  static Future<List<Map<String, dynamic>>> getDesigns({int? artistId, String? q}) async {
+    final out = <Map<String, dynamic>>[];
+    String? cursor;
+    do {
+      final page = await getDesignsPage(artistId: artistId, q: q, cursor: cursor);
+      out.addAll(page.items);
+      cursor = page.nextCursor;
+    } while (cursor != null);
+    return out;
   }
 
   static Future<Map?> createDesign({
@@ -456,3 +475,10 @@ class Api {
     return null;
   }
 }
+
+/// Una página de /designs y el cursor de la siguiente (null si es la última).
+class DesignsPage {
+  final List<Map<String, dynamic>> items;
+  final String? nextCursor;
+  const DesignsPage(this.items, this.nextCursor);
+}
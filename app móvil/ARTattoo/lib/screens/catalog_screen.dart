@@ -19,7 +19,13 @@ class CatalogScreen extends StatefulWidget {
 }
 
 class _CatalogScreenState extends State<CatalogScreen> {
-  late Future<List<Map<String, dynamic>>> _future;
+  late Future<void> _future;
+
+  // ---- Paginación (X-Next-Cursor) ----
+  List<Map<String, dynamic>> _items = [];
+  String? _next;
+  bool _loadingMore = false;
+  int _gen = 0; // descarta páginas que llegan de una búsqueda anterior
 
   // ---- Search ----
   final _qCtrl = TextEditingController();
@@ -33,7 +39,7 @@ class _CatalogScreenState extends State<CatalogScreen> {
   @override
   void initState() {
     super.initState();
-    _future = Api.getDesigns();
+    _future = _loadFirst();
     // Refresca UI del buscador mientras escribes (icono clear, etc.)
     _qCtrl.addListener(() {
       if (mounted) setState(() {});
@@ -75,6 +81,33 @@ class _CatalogScreenState extends State<CatalogScreen> {
     } catch (_) {}
   }
 
+  // ---- Páginas ----
+  Future<void> _loadFirst({String? q}) async {
+    final gen = ++_gen;
+    final page = await Api.getDesignsPage(q: q);
+    if (gen != _gen) return;
+    _items = page.items;
+    _next = page.nextCursor;
+  }
+
+  Future<void> _loadMore() async {
+    if (_loadingMore || _next == null) return;
+    final gen = _gen;
+    _loadingMore = true;
+    try {
+      final page = await Api.getDesignsPage(q: _currentQ, cursor: _next);
+      if (!mounted || gen != _gen) return;
+      setState(() {
+        _items.addAll(page.items);
+        _next = page.nextCursor;
+      });
+    } catch (e) {
+      if (mounted) ScaffoldMessenger.of(context).showSnackBar(ko(e.toString()));
+    } finally {
+      _loadingMore = false;
+    }
+  }
+
   // ---- Búsqueda ----
   void _onSearchChanged(String value) {
     final raw = value.trim();
@@ -85,7 +118,7 @@ class _CatalogScreenState extends State<CatalogScreen> {
     if (raw.isEmpty) {
       // mostrar TODO inmediatamente (sin esperar 250 ms)
       _currentQ = null;
-      setState(() => _future = Api.getDesigns());
+      setState(() => _future = _loadFirst());
       return;
     }
   
@@ -111,18 +144,18 @@ class _CatalogScreenState extends State<CatalogScreen> {
       }
     }
     _currentQ = q;
-    setState(() => _future = Api.getDesigns(q: q));
+    setState(() => _future = _loadFirst(q: q));
   }
 
   Future<void> _clearSearch() async {
     _qCtrl.clear();
     _currentQ = null;
-    setState(() => _future = Api.getDesigns());
+    setState(() => _future = _loadFirst());
   }
 
   // ---- Acciones ----
   Future<void> _refresh() async {
-    setState(() => _future = Api.getDesigns(q: _currentQ));
+    setState(() => _future = _loadFirst(q: _currentQ));
   }
 
   Future<void> _goCreateDesign() async {
@@ -242,7 +275,7 @@ class _CatalogScreenState extends State<CatalogScreen> {
 
           // ---- Lista / Grid ----
           Expanded(
-            child: FutureBuilder<List<Map<String, dynamic>>>(
+            child: FutureBuilder<void>(
               future: _future,
               builder: (_, snap) {
                 if (snap.connectionState != ConnectionState.done) return const Busy();
@@ -251,7 +284,7 @@ class _CatalogScreenState extends State<CatalogScreen> {
                   return Center(child: Text('Error: ${snap.error}'));
                 }
 
-                final items = snap.data ?? const <Map<String, dynamic>>[];
+                final items = _items;
 
                 if (items.isEmpty) {
                   return SafeArea(
@@ -288,6 +321,8 @@ class _CatalogScreenState extends State<CatalogScreen> {
                       ),
                       itemCount: items.length,
                       itemBuilder: (_, i) {
+                        // cerca del final: pide la página siguiente
+                        if (i >= items.length - 6) _loadMore();
                         final d = items[i];
 
                         int likes = 0;
@@ -1,23 +1,62 @@
-import os, requests
+import os, random, requests
+import hashlib
+import sqlite3
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+from dataclasses import dataclass
+from itertools import islice
+from operator import attrgetter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from requests.adapters import HTTPAdapter
 from google.oauth2 import service_account
 from google.auth.transport.requests import Request
 from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 from functools import wraps
 from flask_cors import CORS
 import json
-from flask import Flask, jsonify, request, abort, Response, stream_with_context, redirect
+import mimetypes
+import multiprocessing
+import re
+import unicodedata
+import zlib
+from flask import Flask, g, has_request_context, jsonify, request, abort, Response, send_file, stream_with_context, redirect
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import parse_options_header
+from werkzeug.security import safe_join
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
 from flask_jwt_extended import (
-    JWTManager, create_access_token, create_refresh_token, get_jwt_identity, jwt_required
+    JWTManager, create_access_token, create_refresh_token, get_jwt, get_jwt_identity, jwt_required,
+    verify_jwt_in_request,
 )
 from sqlalchemy import (
-    create_engine, and_, func, or_,  Column, Integer, String, DateTime, Boolean, ForeignKey, Text, UniqueConstraint
+    create_engine, and_, func, or_,  Column, Integer, String, DateTime, Boolean, ForeignKey, Text, UniqueConstraint,
+    Index, LargeBinary, case, event, inspect, select, text as sql_text
 )
-from sqlalchemy.orm import joinedload, sessionmaker, declarative_base, relationship, scoped_session
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, aliased, deferred, joinedload, undefer, sessionmaker, declarative_base, relationship, scoped_session
+from sqlalchemy.sql.expression import TextClause, UpdateBase
 from dotenv import load_dotenv
 from time import sleep
+import asyncio
+import threading
+import weakref
 # === NUEVO ===
 import base64
+import binascii
 import pathlib
+import tempfile
+from urllib.parse import urlparse
+try:
+    import imaging  # derivados con Pillow (opcional)
+except ImportError:
+    imaging = None
+try:
+    import orjson  # codificación JSON rápida (opcional)
+except ImportError:
+    orjson = None
 # =============
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "static/uploads")
 pathlib.Path(UPLOAD_DIR).mkdir(parents=True, exist_ok=True)
@@ -28,16 +67,104 @@ load_dotenv()
 FIREBASE_PROJECT_ID = os.getenv("FIREBASE_PROJECT_ID", "artattoo-5ba9b")
 SCOPES = ["https://www.googleapis.com/auth/firebase.messaging"]
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///tattoo.db")
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {},
-    echo=False,
+# Réplica de lectura opcional: un standby de Postgres, o en local otra base SQLite que la
+# app copia desde el primario tras cada commit (o `flask sync-replica`). Ver ReplicaRouter.
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL") or None
+
+# Perfil de runtime de la DB: "tuned" (por defecto) o "default" (valores del driver/SQLAlchemy,
+# sólo para comparar con bench_db.py).
+DB_RUNTIME_PROFILE = os.getenv("DB_RUNTIME_PROFILE", "tuned")
+# SQLite: WAL deja leer mientras otro escribe; NORMAL sólo hace fsync en los checkpoints
+# (un corte de luz puede perder las últimas transacciones, nunca corromper la base).
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+# Postgres (y otros motores con pool de conexiones)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+def engine_options(url: str, profile: str) -> dict:
+    if url.startswith("sqlite"):
+        opts = {"connect_args": {"check_same_thread": False}}
+        if profile == "tuned":
+            opts["connect_args"]["timeout"] = SQLITE_BUSY_TIMEOUT_MS / 1000
+        return opts
+    if profile != "tuned":
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+engine = create_engine(DATABASE_URL, echo=False, **engine_options(DATABASE_URL, DB_RUNTIME_PROFILE))
+replica_engine = (
+    create_engine(DATABASE_REPLICA_URL, echo=False, **engine_options(DATABASE_REPLICA_URL, DB_RUNTIME_PROFILE))
+    if DATABASE_REPLICA_URL else None
 )
-SessionLocal = scoped_session(sessionmaker(bind=engine))
+
+def _sqlite_pragmas(dbapi_conn, _record):
+    cur = dbapi_conn.cursor()
+    cur.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cur.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cur.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cur.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")  # negativo = KiB
+    cur.close()
+
+def _sqlite_query_only(dbapi_conn, _record):
+    dbapi_conn.execute("PRAGMA query_only=ON")  # la réplica nunca recibe escrituras de la app
+
+for _eng in (engine, replica_engine):
+    if _eng is not None and _eng.dialect.name == "sqlite":
+        if DB_RUNTIME_PROFILE == "tuned":
+            event.listen(_eng, "connect", _sqlite_pragmas)
+        if _eng is replica_engine:
+            event.listen(_eng, "connect", _sqlite_query_only)
+
+def _is_write(clause) -> bool:
+    if isinstance(clause, UpdateBase):  # INSERT / UPDATE / DELETE
+        return True
+    if isinstance(clause, TextClause):
+        return not clause.text.lstrip().upper().startswith(("SELECT", "WITH"))
+    return getattr(clause, "_for_update_arg", None) is not None  # SELECT ... FOR UPDATE
+
+class RoutingSession(Session):
+    """
+    Sin réplica, todo va a `engine`. Con réplica, las lecturas van a `replica_engine` sólo si
+    la sesión lo permite (info["reads"]):
+      "request"   sesión del request (get_db): decide reads_from_replica()
+      "replica"   sesión propia de un stream, decidida al crearla (stream_session)
+      otro/None   primario: sesiones de fondo, CLI y cargas que alimentan caches
+    Flush, INSERT/UPDATE/DELETE y SELECT ... FOR UPDATE van siempre al primario, y después
+    de escribir la sesión ya no lee de la réplica.
+    """
+    def get_bind(self, mapper=None, *, clause=None, bind=None, **kw):
+        if bind is not None:
+            return bind
+        if replica_engine is None:
+            return engine
+        if self._flushing or _is_write(clause):
+            self.info["wrote"] = True
+            note_request_write()
+            return engine
+        reads = self.info.get("reads")
+        if self.info.get("wrote") or not (reads == "replica" or (reads == "request" and reads_from_replica())):
+            return engine
+        return replica_engine
+
+SessionLocal = scoped_session(sessionmaker(bind=engine, class_=RoutingSession))
 Base = declarative_base()
 
 app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
+CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True,
+     expose_headers=["X-Next-Cursor"])
 app.config["JWT_SECRET_KEY"] = os.environ.get(
     "JWT_SECRET_KEY",
     "cambia-esta-clave-larga-y-fija-32+caracteres"
@@ -58,10 +185,20 @@ class Notification(Base):
     type = Column(String(40), nullable=False)  # booking_requested|booking_canceled|payment_received|booking_confirmed|booking_rejected|chat_message
     title = Column(String(120), nullable=False)
     body = Column(Text, nullable=False)
-    data_json = Column(Text, nullable=True)    # payload adicional (appointment_id, thread_id, etc.)
+    # payload adicional (appointment_id, thread_id, etc.); diferido: sólo se lee/decodifica si se usa
+    data_json = deferred(Column(Text, nullable=True))
     read = Column(Boolean, default=False, index=True)
     created_at = Column(DateTime, default=datetime.utcnow, index=True)
 
+    __table_args__ = (
+        # bandeja de no leídas paginada por before_id
+        Index('ix_notifications_user_read_id', 'user_id', 'read', 'id'),
+    )
+
+    @property
+    def data(self) -> dict:
+        return json.loads(self.data_json) if self.data_json else {}
+
 class DeviceToken(Base):
     __tablename__ = "device_tokens"
     id = Column(Integer, primary_key=True)
@@ -86,6 +223,10 @@ class User(Base):
     mp_refresh_token = Column(String, nullable=True)
     mp_scope         = Column(String, nullable=True)
     mp_token_expires_at = Column(DateTime, nullable=True)
+    # total de likes de los diseños del artista (mantenido por add/remove_favorite)
+    likes_total = Column(Integer, nullable=False, default=0, server_default="0")
+    # notificaciones sin leer (mantenido por send_notification / mark_read): badge en O(1)
+    unread_notifications = Column(Integer, nullable=False, default=0, server_default="0")
 
 class Design(Base):
     __tablename__ = "designs"
@@ -96,9 +237,17 @@ class Design(Base):
     price = Column(Integer, nullable=True)   # en la moneda que definas (ej: CLP)
     artist_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # mantenido por add/remove_favorite; reconstruible con `flask rebuild-like-counters`
+    likes_count = Column(Integer, nullable=False, default=0, server_default="0")
 
     artist = relationship("User", back_populates="designs")
 
+    __table_args__ = (
+        # catálogo paginado por keyset (created_at, id), global y por artista
+        Index('ix_designs_created_id', 'created_at', 'id'),
+        Index('ix_designs_artist_created_id', 'artist_id', 'created_at', 'id'),
+    )
+
 
 class Appointment(Base):
     __tablename__ = "appointments"
@@ -122,6 +271,8 @@ class Appointment(Base):
     __table_args__ = (
         # Evita doble booking exacto mismo tramo (no perfecto, pero ayuda)
         UniqueConstraint('artist_id', 'start_time', name='uq_artist_slot'),
+        # agenda del cliente por ventana/keyset (start_time, id); la del artista usa uq_artist_slot
+        Index('ix_appointments_client_start', 'client_id', 'start_time', 'id'),
     )
 class Payment(Base):
     __tablename__ = "payments"
@@ -142,8 +293,21 @@ class ChatThread(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, index=True)
 
+    # Resumen mantenido en la misma transacción que chat_send_message / chat_mark_read
+    # (evita el N+1 de /chat/threads). Reconstruible con `flask rebuild-thread-summaries`.
+    last_message_id = Column(Integer, nullable=True)
+    last_message_preview = Column(String(200), nullable=True)
+    last_message_image_url = Column(Text, nullable=True)
+    last_message_sender_id = Column(Integer, nullable=True)
+    last_message_at = Column(DateTime, nullable=True)
+    unread_artist = Column(Integer, nullable=False, default=0, server_default="0")
+    unread_client = Column(Integer, nullable=False, default=0, server_default="0")
+
     __table_args__ = (
         UniqueConstraint('artist_id', 'client_id', name='uq_chat_pair'),
+        # bandeja ordenada por actividad, por participante (keyset sobre updated_at, id)
+        Index('ix_chat_threads_artist_updated', 'artist_id', 'updated_at', 'id'),
+        Index('ix_chat_threads_client_updated', 'client_id', 'updated_at', 'id'),
     )
 
     artist = relationship("User", foreign_keys=[artist_id])
@@ -173,14 +337,465 @@ class Favorite(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
     __table_args__ = (UniqueConstraint('user_id','design_id', name='uq_fav'),)
+
+class ArtistSearchTerm(Base):
+    """
+    Directorio de artistas para búsqueda '@nombre': un término normalizado (sin tildes,
+    minúsculas) por palabra del nombre, del email y el email completo. Sólo role == 'artist'.
+    """
+    __tablename__ = "artist_search_terms"
+    term = Column(String(255), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True, index=True)
+
+    __table_args__ = (
+        # LIKE 'w%' indexado con cualquier collation de la base (la PK sigue la del cluster)
+        Index('ix_artist_search_terms_term_pattern', 'term',
+              postgresql_ops={'term': 'text_pattern_ops'}).ddl_if(dialect='postgresql'),
+    )
+
+class ColdSegment(Base):
+    """
+    Almacenamiento frío: un lote de filas antiguas (notifications o chat_messages) de un
+    mismo dueño (user_id / thread_id), como JSON comprimido con zlib. Sus filas ya no están
+    en la tabla caliente; [min_id, max_id] es el índice id -> segmento.
+    """
+    __tablename__ = "cold_segments"
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(20), nullable=False)      # 'notification' | 'chat_message'
+    owner_id = Column(Integer, nullable=False)     # user_id | thread_id
+    min_id = Column(Integer, nullable=False)
+    max_id = Column(Integer, nullable=False)
+    row_count = Column(Integer, nullable=False)
+    payload = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index('ix_cold_segments_owner_max', 'kind', 'owner_id', 'max_id'),
+    )
+
+    def rows(self) -> list[dict]:
+        return json.loads(zlib.decompress(self.payload))
+
 def init_db():
     Base.metadata.create_all(bind=engine)
+    added = _add_missing_columns()
+    _create_missing_indexes()
+    design_search_backend()
+    db = SessionLocal.session_factory()
+    try:
+        if not db.query(ArtistSearchTerm.user_id).first():
+            rebuild_artist_directory(db)
+    finally:
+        db.close()
+    if ("designs", "likes_count") in added or ("users", "likes_total") in added:
+        db = SessionLocal.session_factory()
+        try:
+            rebuild_like_counters(db)
+        finally:
+            db.close()
+    if ("chat_threads", "last_message_id") in added:
+        db = SessionLocal.session_factory()
+        try:
+            rebuild_thread_summaries(db)
+        finally:
+            db.close()
+    if ("users", "unread_notifications") in added:
+        db = SessionLocal.session_factory()
+        try:
+            rebuild_notification_counters(db)
+        finally:
+            db.close()
+    if replica_router is not None and replica_router.kind == "sqlite":
+        replica_router.sync()  # réplica local: arranca con el esquema y los datos del primario
+
+def _add_missing_columns() -> set[tuple[str, str]]:
+    """create_all no altera tablas existentes: agrega (ADD COLUMN) las columnas nuevas de los modelos."""
+    insp = inspect(engine)
+    added = set()
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not insp.has_table(table.name):
+                continue
+            existing = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(dialect=engine.dialect)}"
+                if col.server_default is not None:
+                    ddl += f" DEFAULT {col.server_default.arg}"
+                    if not col.nullable:
+                        ddl += " NOT NULL"
+                conn.execute(sql_text(ddl))
+                added.add((table.name, col.name))
+    return added
+
+def _create_missing_indexes():
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+def rebuild_thread_summaries(db):
+    """Recalcula último mensaje y no leídos de todos los hilos desde chat_messages."""
+    last_ids = dict(
+        db.query(ChatMessage.thread_id, func.max(ChatMessage.id)).group_by(ChatMessage.thread_id).all()
+    )
+    last_msgs = {
+        m.thread_id: m
+        for m in db.query(ChatMessage).filter(ChatMessage.id.in_(list(last_ids.values()))).all()
+    } if last_ids else {}
+    unread_artist = dict(
+        db.query(ChatMessage.thread_id, func.count(ChatMessage.id))
+          .join(ChatThread, ChatThread.id == ChatMessage.thread_id)
+          .filter(ChatMessage.sender_id != ChatThread.artist_id, ChatMessage.seen_by_artist == False)
+          .group_by(ChatMessage.thread_id).all()
+    )
+    unread_client = dict(
+        db.query(ChatMessage.thread_id, func.count(ChatMessage.id))
+          .join(ChatThread, ChatThread.id == ChatMessage.thread_id)
+          .filter(ChatMessage.sender_id != ChatThread.client_id, ChatMessage.seen_by_client == False)
+          .group_by(ChatMessage.thread_id).all()
+    )
+    for th in db.query(ChatThread).all():
+        m = last_msgs.get(th.id)
+        th.last_message_id = m.id if m else None
+        th.last_message_preview = message_preview(m.text) if m else None
+        th.last_message_image_url = m.image_url if m else None
+        th.last_message_sender_id = m.sender_id if m else None
+        th.last_message_at = m.created_at if m else None
+        th.unread_artist = int(unread_artist.get(th.id, 0))
+        th.unread_client = int(unread_client.get(th.id, 0))
+    db.commit()
+
+def rebuild_like_counters(db):
+    """Recalcula designs.likes_count y users.likes_total desde la tabla favorites."""
+    per_design = (
+        select(func.count(Favorite.id))
+        .where(Favorite.design_id == Design.id)
+        .scalar_subquery()
+    )
+    db.query(Design).update({Design.likes_count: per_design}, synchronize_session=False)
+    per_artist = (
+        select(func.coalesce(func.sum(Design.likes_count), 0))
+        .where(Design.artist_id == User.id)
+        .scalar_subquery()
+    )
+    db.query(User).update({User.likes_total: per_artist}, synchronize_session=False)
+    db.commit()
+
+def rebuild_notification_counters(db):
+    """Recalcula users.unread_notifications desde la tabla notifications."""
+    unread = (
+        select(func.count(Notification.id))
+        .where(Notification.user_id == User.id, Notification.read == False)
+        .scalar_subquery()
+    )
+    db.query(User).update({User.unread_notifications: unread}, synchronize_session=False)
+    db.commit()
+
+@app.cli.command("rebuild-notification-counters")
+def rebuild_notification_counters_command():
+    """Reconcilia el contador de notificaciones sin leer de cada usuario."""
+    db = SessionLocal.session_factory()
+    try:
+        rebuild_notification_counters(db)
+        print("ok")
+    finally:
+        db.close()
+
+@app.cli.command("rebuild-like-counters")
+def rebuild_like_counters_command():
+    """Reconcilia los contadores de likes con la tabla favorites."""
+    db = SessionLocal.session_factory()
+    try:
+        rebuild_like_counters(db)
+        print("ok")
+    finally:
+        db.close()
+
+@app.cli.command("rebuild-thread-summaries")
+def rebuild_thread_summaries_command():
+    """Reconstruye el resumen denormalizado de chat_threads."""
+    db = SessionLocal.session_factory()
+    try:
+        rebuild_thread_summaries(db)
+        print("ok")
+    finally:
+        db.close()
 
 # =========================
 # Helpers
 # =========================
 def get_db():
-    return SessionLocal()
+    db = SessionLocal()
+    db.info["reads"] = "request"
+    return db
+
+@app.teardown_appcontext
+def remove_db_session(exc=None):
+    """
+    Descarta la sesión del hilo al terminar cada request (con stream_with_context, al cerrar
+    el stream): ninguna sesión ni conexión queda colgada del registro entre requests.
+    """
+    SessionLocal.remove()
+
+# --- Réplica de lectura (read-your-writes) ---
+REPLICA_SYNC_SECONDS = float(os.getenv("REPLICA_SYNC_SECONDS", "1"))  # par SQLite: copias agrupadas
+REPLICA_POSITION_TTL = float(os.getenv("REPLICA_POSITION_TTL", "0.5"))  # Postgres: cache del LSN del standby
+
+def _pg_lsn(value: str | None) -> int:
+    """LSN de Postgres ('16/B374D848') como entero comparable; NULL (no es standby) -> 0."""
+    hi, _, lo = (value or "0/0").partition("/")
+    return (int(hi, 16) << 32) + int(lo, 16)
+
+class ReplicaRouter:
+    """
+    Read-your-writes por POSICIÓN de la réplica, no por tiempo: cada escritura anota la
+    posición del primario en que quedó y las lecturas de ese usuario van al primario hasta
+    que la réplica la alcanza (quien acaba de reservar ve su cita en /appointments/me, y la
+    sigue viendo aunque la réplica tarde).
+    - "postgresql": pg_current_wal_lsn() del primario tras escribir vs pg_last_wal_replay_lsn()
+      del standby (consultado como mucho cada REPLICA_POSITION_TTL).
+    - "sqlite" (par local): nada más refresca la réplica, así que cada commit numera la
+      escritura y agenda una copia (sync_sqlite_replica) en un hilo, agrupando los commits de
+      REPLICA_SYNC_SECONDS. La réplica alcanza lo confirmado antes de empezar la última copia.
+    Por proceso, como el resto de caches: con varios workers, afinidad por usuario en el balanceador.
+    """
+    def __init__(self, kind: str):
+        self.kind = kind
+        self._lock = threading.Lock()
+        self._pending: dict[int, int] = {}  # uid -> posición de su última escritura
+        self._last_write = 0                # última escritura de un request de este proceso
+        self._seq = 0                       # "sqlite": commits numerados
+        self._replica = (0, float("-inf"))  # (posición alcanzada por la réplica, leída en)
+        self._sync_scheduled = False
+
+    def _primary_position(self) -> int:
+        if self.kind == "postgresql":
+            with engine.connect() as conn:
+                return _pg_lsn(conn.exec_driver_sql("SELECT pg_current_wal_lsn()::text").scalar())
+        with self._lock:
+            return self._seq
+
+    def replica_position(self) -> int:
+        pos, at = self._replica
+        if self.kind == "sqlite" or time.monotonic() - at < REPLICA_POSITION_TTL:
+            return pos
+        with replica_engine.connect() as conn:
+            pos = _pg_lsn(conn.exec_driver_sql("SELECT pg_last_wal_replay_lsn()::text").scalar())
+        self._replica = (pos, time.monotonic())
+        return pos
+
+    def mark_write(self, uid: int | None):
+        pos = self._primary_position()
+        with self._lock:
+            self._last_write = max(self._last_write, pos)
+            if uid:
+                self._pending[uid] = pos
+            if len(self._pending) > 10000:
+                reached = self._replica[0]
+                self._pending = {k: p for k, p in self._pending.items() if p > reached}
+
+    def is_sticky(self, uid: int | None) -> bool:
+        if not uid:
+            return False
+        with self._lock:
+            pos = self._pending.get(uid)
+        if pos is None:
+            return False
+        if self.replica_position() < pos:
+            return True
+        with self._lock:
+            if self._pending.get(uid) == pos:
+                del self._pending[uid]
+        return False
+
+    def lagging(self) -> bool:
+        """La réplica aún no tiene la última escritura hecha desde este proceso."""
+        with self._lock:
+            last = self._last_write
+        return self.replica_position() < last
+
+    # --- par SQLite ---
+    def note_commit(self):
+        with self._lock:
+            self._seq += 1
+            if self._sync_scheduled:
+                return
+            self._sync_scheduled = True
+        t = threading.Timer(REPLICA_SYNC_SECONDS, self.sync)
+        t.daemon = True
+        t.start()
+
+    def sync(self):
+        """Copia el primario sobre la réplica; lo confirmado antes de empezar queda alcanzado."""
+        with self._lock:
+            self._sync_scheduled = False  # lo que se confirme durante la copia agenda otra
+            seq = self._seq
+        try:
+            sync_sqlite_replica()
+        except Exception as e:
+            print(f"[replica] copia fallida ({e!r}); se reintentará")
+            return self.note_commit()
+        with self._lock:
+            self._replica = (max(self._replica[0], seq), time.monotonic())
+
+def _replica_kind() -> str | None:
+    if replica_engine is None:
+        return None
+    if engine.dialect.name == replica_engine.dialect.name == "sqlite":
+        return "sqlite"
+    if engine.dialect.name == replica_engine.dialect.name == "postgresql":
+        return "postgresql"
+    return None
+
+if replica_engine is not None and _replica_kind() is None:
+    # sin forma de saber cuánto lleva la réplica, leer de ella podría no ver lo propio
+    print(f"Réplica {replica_engine.dialect.name} sin posición conocida: las lecturas van al primario")
+    replica_engine.dispose()
+    replica_engine = None
+
+replica_router = ReplicaRouter(_replica_kind()) if replica_engine is not None else None
+
+if replica_router is not None and replica_router.kind == "sqlite":
+    @event.listens_for(RoutingSession, "after_commit")
+    def _replica_note_commit(session):
+        replica_router.note_commit()
+
+def primary_db(fn):
+    """GET que lee siempre del primario (streams en tiempo real). Va justo debajo de @app.get."""
+    fn.primary_db = True
+    return fn
+
+def reads_from_replica() -> bool:
+    """
+    Si las lecturas de este request pueden ir a la réplica (se decide una vez por request):
+    GET/HEAD sin @primary_db y de un usuario cuya última escritura ya llegó a la réplica.
+    """
+    if replica_engine is None or not has_request_context():
+        return False
+    route = g.get("db_reads")
+    if route is None:
+        view = app.view_functions.get(request.endpoint)
+        ok = request.method in ("GET", "HEAD") and not getattr(view, "primary_db", False)
+        route = "replica" if ok and not replica_router.is_sticky(optional_identity()) else "primary"
+        g.db_reads = route
+    return route == "replica"
+
+def note_request_write():
+    if has_request_context():
+        g.db_wrote = True
+
+@app.after_request
+def stick_to_primary_after_write(resp):
+    if g.get("db_wrote") and replica_router is not None:
+        replica_router.mark_write(optional_identity())
+    return resp
+
+def stream_session():
+    """Sesión propia para una respuesta en streaming: lee de donde leería este request."""
+    return SessionLocal.session_factory(info={"reads": "replica" if reads_from_replica() else "primary"})
+
+def sync_sqlite_replica():
+    """Copia consistente del primario SQLite sobre la réplica SQLite (API de backup)."""
+    src = sqlite3.connect(engine.url.database)
+    dst = sqlite3.connect(replica_engine.url.database)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+@app.cli.command("sync-replica")
+def sync_replica_command():
+    """Refresca la réplica local (DATABASE_URL y DATABASE_REPLICA_URL SQLite)."""
+    if replica_engine is None or engine.dialect.name != "sqlite" or replica_engine.dialect.name != "sqlite":
+        print("sync-replica sólo aplica a un par SQLite (DATABASE_URL + DATABASE_REPLICA_URL)")
+        return
+    sync_sqlite_replica()
+    print("ok")
+
+# --- Identidad: snapshots de usuario en cache ---
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "4096"))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "300"))  # cota de desfase entre procesos
+
+@dataclass(frozen=True, slots=True)
+class UserSnapshot:
+    """Datos de identidad inmutables de un usuario (sin contadores ni tokens de MP)."""
+    id: int
+    email: str
+    role: str
+    name: str
+
+class UserCache:
+    """
+    Snapshots de usuario por id: memo por request (flask.g) sobre un LRU de proceso con TTL.
+    Cualquier UPDATE/DELETE de User por el ORM invalida la entrada (eventos del mapper);
+    entre procesos el desfase queda acotado por USER_CACHE_TTL. No se cachean ausencias.
+    """
+    def __init__(self, max_entries: int, ttl: float):
+        self._max = max_entries
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[int, tuple[float, UserSnapshot]] = OrderedDict()
+        self._hits = self._misses = 0
+
+    def get(self, uid: int, db=None) -> UserSnapshot | None:
+        memo = g.setdefault("users", {}) if has_request_context() else {}
+        if uid in memo:
+            return memo[uid]
+        now = time.monotonic()
+        with self._lock:
+            e = self._entries.get(uid)
+            if e and e[0] > now:
+                self._entries.move_to_end(uid)
+                self._hits += 1
+                memo[uid] = e[1]
+                return e[1]
+            self._misses += 1
+        # del primario: el snapshot se queda en cache y un usuario recién registrado
+        # puede no estar aún en la réplica
+        row = (db or get_db()).execute(
+            select(User.id, User.email, User.role, User.name).where(User.id == uid),
+            bind_arguments={"bind": engine},
+        ).first()
+        snap = UserSnapshot(*row) if row else None
+        if snap:
+            with self._lock:
+                self._entries[uid] = (now + self._ttl, snap)
+                self._entries.move_to_end(uid)
+                while len(self._entries) > self._max:
+                    self._entries.popitem(last=False)
+        memo[uid] = snap
+        return snap
+
+    def invalidate(self, uid: int):
+        with self._lock:
+            self._entries.pop(uid, None)
+        if has_request_context():
+            g.get("users", {}).pop(uid, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self._hits, "misses": self._misses}
+
+user_cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_user_snapshot(mapper, connection, target):
+    user_cache.invalidate(target.id)
+
+def current_user() -> UserSnapshot | None:
+    """Usuario del JWT verificado en este request (sin consulta si ya está en cache)."""
+    return user_cache.get(int(get_jwt_identity()))
+
+def current_role() -> str | None:
+    """Rol del JWT (claim 'role'); sólo tokens sin el claim consultan el usuario."""
+    role = get_jwt().get("role")
+    if role:
+        return role
+    me = current_user()
+    return me.role if me else None
 
 def role_required(required_role):
     """Decorator para exigir rol específico en endpoints protegidos."""
@@ -188,17 +803,14 @@ def role_required(required_role):
         @wraps(fn)
         @jwt_required()
         def inner(*args, **kwargs):
-            db = get_db()
-            try:
-                uid = get_jwt_identity()
-                user = db.get(User, int(uid))
-                if not user or user.role != required_role:
-                    return jsonify({"msg": "No autorizado para este recurso"}), 403
-                # inyectamos user en request context de forma simple
-                request.current_user = user
-                return fn(*args, **kwargs)
-            finally:
-                db.close()
+            if current_role() != required_role:
+                return jsonify({"msg": "No autorizado para este recurso"}), 403
+            user = current_user()
+            if not user:
+                return jsonify({"msg": "No autorizado para este recurso"}), 403
+            # inyectamos user en request context de forma simple
+            request.current_user = user
+            return fn(*args, **kwargs)
         return inner
     return wrapper
 
@@ -208,13 +820,16 @@ def hash_pw(raw: str) -> str:
     import hashlib
     return hashlib.sha256(raw.encode()).hexdigest()
 
+# una cita ocupa la agenda salvo que esté cancelada o rechazada
+FREE_APPT_STATUSES = ("canceled", "rejected")
+
 def check_overlap(db, artist_id: int, start_time: datetime, end_time: datetime) -> bool:
     """True si hay choque de hora para el artista."""
     q = (
         db.query(Appointment)
         .filter(
             Appointment.artist_id == artist_id,
-            Appointment.status == "booked",
+            Appointment.status.notin_(FREE_APPT_STATUSES),
             Appointment.start_time < end_time,
             Appointment.end_time > start_time,
         )
@@ -225,6 +840,10 @@ def parse_dt(s: str) -> datetime:
     # Espera ISO 8601 (ej: "2025-09-12T15:00:00")
     return datetime.fromisoformat(s)
 
+def parse_db_dt(v) -> datetime:
+    """Agregados (MIN/MAX) sobre DateTime pueden volver como texto en SQLite."""
+    return v if isinstance(v, datetime) else datetime.fromisoformat(str(v))
+
 # === NUEVO: helpers de cuota y guardado ===
 def today_range_utc():
     """Devuelve (inicio, fin) del día UTC actual para conteo diario."""
@@ -277,22 +896,15 @@ def notifications_test():
 
 def save_base64_png(b64_str: str, user_id: int) -> str:
     """
-    Guarda el base64 (PNG) en IMAGE_SAVE_DIR y devuelve URL pública.
+    Guarda el base64 en UPLOAD_DIR (mismo almacén que /upload/image) y devuelve URL pública.
     """
-    raw = base64.b64decode(b64_str)
-    ts = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
-    filename = f"user{user_id}_{ts}.png"
-    out_path = pathlib.Path(IMAGE_SAVE_DIR) / filename
-    out_path.write_bytes(raw)
-    # arma URL pública. Con Flask dev, /static se sirve por defecto.
-    rel = str(out_path).replace("\\", "/")
-    return f"{PUBLIC_BASE_URL}/{rel}"
+    return upload_url(store_upload_bytes(base64.b64decode(b64_str))["filename"])
 def ensure_pair_is_artist_client(db, uid_a: int, uid_b: int):
     """
     Devuelve (artist_id, client_id) si la pareja es válida, o (None, None) si no.
     """
-    a = db.get(User, uid_a)
-    b = db.get(User, uid_b)
+    a = user_cache.get(uid_a, db)
+    b = user_cache.get(uid_b, db)
     if not a or not b:
         return (None, None)
     if a.role == "artist" and b.role == "client":
@@ -301,6 +913,54 @@ def ensure_pair_is_artist_client(db, uid_a: int, uid_b: int):
         return (b.id, a.id)
     return (None, None)
 
+CHAT_PREVIEW_CHARS = 200
+
+def message_preview(text: str | None) -> str | None:
+    return text[:CHAT_PREVIEW_CHARS] if text else None
+
+def apply_message_to_thread(th: ChatThread, msg: ChatMessage):
+    """
+    Actualiza el resumen del hilo con un mensaje recién insertado (flush previo para tener msg.id).
+    Debe ir en el mismo commit que el insert. Los no leídos se incrementan en SQL
+    para no perder incrementos concurrentes.
+    """
+    th.last_message_id = msg.id
+    th.last_message_preview = message_preview(msg.text)
+    th.last_message_image_url = msg.image_url
+    th.last_message_sender_id = msg.sender_id
+    th.last_message_at = msg.created_at
+    th.updated_at = msg.created_at
+    if msg.sender_id != th.artist_id:
+        th.unread_artist = ChatThread.unread_artist + 1
+    if msg.sender_id != th.client_id:
+        th.unread_client = ChatThread.unread_client + 1
+
+def bump_like_counters(db, design_id: int, artist_id: int, delta: int):
+    """Suma delta a los likes del diseño y al total del artista, en SQL (mismo commit que el favorito)."""
+    db.query(Design).filter(Design.id == design_id).update(
+        {Design.likes_count: Design.likes_count + delta}, synchronize_session=False
+    )
+    db.query(User).filter(User.id == artist_id).update(
+        {User.likes_total: User.likes_total + delta}, synchronize_session=False
+    )
+
+def encode_cursor(*values) -> str:
+    """Cursor opaco para paginación keyset (datetimes en ISO 8601)."""
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str | None) -> list | None:
+    """Inverso de encode_cursor. Lanza ValueError si el cursor no es válido."""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError("cursor inválido")
+    if not isinstance(values, list):
+        raise ValueError("cursor inválido")
+    return values
+
 def thread_for_pair(db, artist_id: int, client_id: int) -> ChatThread | None:
     return (
         db.query(ChatThread)
@@ -309,95 +969,674 @@ def thread_for_pair(db, artist_id: int, client_id: int) -> ChatThread | None:
     )
 
 # =========================
-# Notificaciones
+# Serialización JSON
 # =========================
-def _get_access_token():
+# orjson codifica datetimes de forma nativa (mismo ISO 8601 que .isoformat()) y
+# devuelve bytes; sin orjson se usa json de la stdlib con el mismo formato.
+JSON_STREAM_BATCH = int(os.getenv("JSON_STREAM_BATCH", "200"))
+
+def _json_default(o):
+    if isinstance(o, datetime):
+        return o.isoformat()
+    raise TypeError(f"{type(o).__name__} no es serializable a JSON")
+
+if orjson:
+    def json_dumps(obj, sort_keys: bool = False) -> bytes:
+        opts = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(obj, default=_json_default, option=opts)
+else:
+    def json_dumps(obj, sort_keys: bool = False) -> bytes:
+        return json.dumps(obj, default=_json_default, sort_keys=sort_keys,
+                          ensure_ascii=False, separators=(",", ":")).encode()
+
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify/get_json sobre json_dumps; conserva sort_keys de Flask (mismas claves y orden)."""
+    def dumps(self, obj, **kwargs) -> str:
+        kwargs.setdefault("sort_keys", self.sort_keys)
+        if kwargs.get("indent"):  # salida legible (modo debug)
+            return json.dumps(obj, default=_json_default, ensure_ascii=False, **kwargs)
+        return json_dumps(obj, sort_keys=kwargs["sort_keys"]).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson:
+            try:
+                return orjson.loads(s)
+            except orjson.JSONDecodeError:
+                pass  # NaN/Infinity y otras extensiones que el parser de la stdlib sí acepta
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs) -> Response:
+        if self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(json_dumps(obj, sort_keys=self.sort_keys) + b"\n",
+                                        mimetype=self.mimetype)
+
+app.json = FastJSONProvider(app)
+
+class RowSerializer:
     """
-    Obtiene un access token OAuth2 usando el Service Account para llamar FCM HTTP v1.
-    Requiere GOOGLE_APPLICATION_CREDENTIALS apuntando al JSON del service account.
+    Serializador declarativo de filas a dict; los campos se resuelven una vez a pares
+    (clave, getter) y cada llamada sólo los recorre.
+    Campos:
+      "id"                        atributo homónimo
+      ("design_id", "id")         otra clave para el atributo
+      ("likes_count", fn)         calculado: fn(obj)
+      ("*", fn)                   fn(obj) devuelve un dict que se mezcla (p. ej. variantes de imagen)
+    Los datetimes se dejan tal cual: los codifica json_dumps.
+    Uso: SER(obj) o SER(obj, extra=valor) para claves propias del endpoint.
+    """
+    def __init__(self, *fields):
+        self.fields = tuple((f, f) if isinstance(f, str) else tuple(f) for f in fields)
+        self._getters = tuple((key, self._getter(src)) for key, src in self.fields)
+
+    @staticmethod
+    def _getter(src):
+        if callable(src):
+            return src
+        if isinstance(src, str) and src.isidentifier():
+            return attrgetter(src)
+        raise ValueError(f"campo inválido: {src!r}")
+
+    def __call__(self, obj, **extra) -> dict:
+        out = {}
+        for key, get in self._getters:
+            if key == "*":
+                out.update(get(obj))
+            else:
+                out[key] = get(obj)
+        if extra:
+            out.update(extra)
+        return out
+
+    def without(self, *keys) -> "RowSerializer":
+        return RowSerializer(*(f for f in self.fields if f[0] not in keys))
+
+def json_stream(rows, serialize) -> Response:
+    """
+    Arreglo JSON codificado por lotes de JSON_STREAM_BATCH mientras se itera rows
+    (p. ej. un query con yield_per): ni la lista de dicts ni el cuerpo completo
+    quedan en memoria. Quien abre una sesión para rows la cierra con call_on_close.
+    """
+    def gen():
+        it = iter(rows)
+        yield b"["
+        sep = b""
+        while batch := list(islice(it, JSON_STREAM_BATCH)):
+            yield sep + json_dumps([serialize(r) for r in batch], sort_keys=app.json.sort_keys)[1:-1]
+            sep = b","
+        yield b"]\n"
+    return Response(gen(), mimetype="application/json")
+
+# =========================
+# Realtime (pub/sub para SSE)
+# =========================
+SSE_KEEPALIVE_SECONDS = float(os.getenv("SSE_KEEPALIVE_SECONDS", "15"))
+
+class Subscription:
+    """Suscripción a un canal: se despierta cuando alguien publica en él."""
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self._event = threading.Event()
+
+    def notify(self):
+        self._event.set()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """True si hubo publicación (consume el aviso), False si venció el timeout."""
+        fired = self._event.wait(timeout)
+        if fired:
+            self._event.clear()
+        return fired
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+class AsyncSubscription(Subscription):
+    """Variante para corrutinas (modo ASGI): el aviso llega desde cualquier hilo vía el loop."""
+    def __init__(self, broker, channel, loop):
+        super().__init__(broker, channel)
+        self._loop = loop
+        self._aevent = asyncio.Event()
+
+    def notify(self):
+        self._loop.call_soon_threadsafe(self._aevent.set)
+
+    async def wait(self, timeout: float | None = None) -> bool:
+        try:
+            await asyncio.wait_for(self._aevent.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self._aevent.clear()
+        return True
+
+class EventBroker:
     """
-    creds = service_account.Credentials.from_service_account_file(
+    Pub/sub en memoria (por proceso). Los endpoints publican DESPUÉS del commit
+    y los streams SSE bloquean en su suscripción, así un stream inactivo no hace
+    consultas. El aviso no trae datos: el stream relee sólo las filas nuevas (id > last_id).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subs: dict[tuple, set[Subscription]] = {}
+
+    def subscribe(self, channel: tuple) -> Subscription:
+        return self._add(Subscription(self, channel))
+
+    def subscribe_async(self, channel: tuple) -> AsyncSubscription:
+        """Debe llamarse desde el event loop que va a esperar la suscripción."""
+        return self._add(AsyncSubscription(self, channel, asyncio.get_running_loop()))
+
+    def _add(self, sub):
+        with self._lock:
+            self._subs.setdefault(sub.channel, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            subs = self._subs.get(sub.channel)
+            if subs:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[sub.channel]
+
+    def publish(self, channel: tuple):
+        with self._lock:
+            subs = list(self._subs.get(channel, ()))
+        for sub in subs:
+            sub.notify()
+
+broker = EventBroker()
+
+def notifications_channel(user_id: int) -> tuple:
+    return ("notifications", int(user_id))
+
+def chat_channel(thread_id: int) -> tuple:
+    return ("chat", int(thread_id))
+
+# Lecturas y payloads compartidos por los streams WSGI (abajo) y ASGI (asgi.py)
+def notifications_after(db, user_id: int, last_id: int) -> list:
+    return (
+        db.query(Notification)
+        .options(undefer(Notification.data_json))  # el stream cierra la sesión antes de serializar
+        .filter(Notification.user_id == user_id, Notification.id > last_id)
+        .order_by(Notification.id.asc())
+        .all()
+    )
+
+def chat_messages_after(db, thread_id: int, last_id: int) -> list:
+    return (
+        db.query(ChatMessage)
+        .filter(ChatMessage.thread_id == thread_id, ChatMessage.id > last_id)
+        .order_by(ChatMessage.id.asc())
+        .all()
+    )
+
+def chat_last_message_id(db, thread_id: int) -> int:
+    last = (
+        db.query(ChatMessage.id)
+        .filter(ChatMessage.thread_id == thread_id)
+        .order_by(ChatMessage.id.desc())
+        .first()
+    )
+    return last[0] if last else 0
+
+NOTIFICATION_JSON = RowSerializer("id", "type", "title", "body", "read", "data", "created_at")
+NOTIFICATION_COMPACT_JSON = NOTIFICATION_JSON.without("data")
+NOTIFICATION_EVENT_JSON = NOTIFICATION_JSON.without("read")
+CHAT_MESSAGE_JSON = RowSerializer(
+    "id", "sender_id", "text", "image_url",
+    ("*", lambda m: image_store.variants(m.image_url)),
+    "created_at",
+)
+
+def notification_payload(r: Notification) -> dict:
+    return NOTIFICATION_EVENT_JSON(r)
+
+def chat_message_payload(m: ChatMessage) -> dict:
+    return CHAT_MESSAGE_JSON(m)
+
+def sse_event(event: str, payload) -> str:
+    """Un evento SSE con el payload en JSON compacto (claves ordenadas, como jsonify)."""
+    return f"event: {event}\ndata: {json_dumps(payload, sort_keys=True).decode()}\n\n"
+
+# =========================
+# Retención (hot/cold)
+# =========================
+NOTIFICATIONS_HOT_DAYS = int(os.getenv("NOTIFICATIONS_HOT_DAYS", "30"))
+CHAT_HOT_DAYS = int(os.getenv("CHAT_HOT_DAYS", "90"))
+COLD_SEGMENT_ROWS = int(os.getenv("COLD_SEGMENT_ROWS", "500"))
+COLD_BATCH_ROWS = int(os.getenv("COLD_BATCH_ROWS", "5000"))
+
+def _iso(v) -> str | None:
+    return v.isoformat() if v else None
+
+def notification_cold_row(n: Notification) -> dict:
+    return {
+        "id": n.id, "user_id": n.user_id, "type": n.type, "title": n.title, "body": n.body,
+        "data_json": n.data_json, "read": n.read, "created_at": _iso(n.created_at),
+    }
+
+def chat_message_cold_row(m: ChatMessage) -> dict:
+    return {
+        "id": m.id, "thread_id": m.thread_id, "sender_id": m.sender_id, "text": m.text,
+        "image_url": m.image_url, "created_at": _iso(m.created_at),
+        "seen_by_artist": m.seen_by_artist, "seen_by_client": m.seen_by_client,
+    }
+
+def _archive(db, kind: str, q, owner_of, to_row) -> int:
+    """Mueve a segmentos fríos las filas de q (por lotes; segmento + borrado en la misma transacción)."""
+    moved = 0
+    while True:
+        rows = q.limit(COLD_BATCH_ROWS).all()
+        if not rows:
+            return moved
+        by_owner: dict[int, list[dict]] = {}
+        for r in rows:
+            by_owner.setdefault(owner_of(r), []).append(to_row(r))
+        for owner_id, items in by_owner.items():
+            for i in range(0, len(items), COLD_SEGMENT_ROWS):
+                chunk = items[i:i + COLD_SEGMENT_ROWS]
+                db.add(ColdSegment(
+                    kind=kind, owner_id=owner_id,
+                    min_id=chunk[0]["id"], max_id=chunk[-1]["id"], row_count=len(chunk),
+                    payload=zlib.compress(json.dumps(chunk, separators=(",", ":")).encode()),
+                ))
+        model = type(rows[0])
+        db.query(model).filter(model.id.in_([r.id for r in rows])).delete(synchronize_session=False)
+        db.commit()
+        moved += len(rows)
+
+def archive_cold(db, now: datetime | None = None) -> dict:
+    """
+    Pasa a frío:
+    - notificaciones LEÍDAS con más de NOTIFICATIONS_HOT_DAYS (las no leídas siguen calientes:
+      el contador users.unread_notifications sólo mira la tabla caliente);
+    - mensajes con más de CHAT_HOT_DAYS ya vistos por todos sus destinatarios y que no son el
+      último del hilo (no leídos y resumen de chat_threads se siguen calculando en caliente).
+    """
+    now = now or datetime.utcnow()
+    notifications = (
+        db.query(Notification)
+          .options(undefer(Notification.data_json))
+          .filter(Notification.read == True,
+                  Notification.created_at < now - timedelta(days=NOTIFICATIONS_HOT_DAYS))
+          .order_by(Notification.user_id, Notification.id)
+    )
+    messages = (
+        db.query(ChatMessage)
+          .join(ChatThread, ChatThread.id == ChatMessage.thread_id)
+          .filter(
+              ChatMessage.created_at < now - timedelta(days=CHAT_HOT_DAYS),
+              ChatMessage.id < ChatThread.last_message_id,
+              or_(ChatMessage.sender_id == ChatThread.artist_id, ChatMessage.seen_by_artist == True),
+              or_(ChatMessage.sender_id == ChatThread.client_id, ChatMessage.seen_by_client == True),
+          )
+          .order_by(ChatMessage.thread_id, ChatMessage.id)
+    )
+    return {
+        "notifications": _archive(db, "notification", notifications, lambda n: n.user_id, notification_cold_row),
+        "chat_messages": _archive(db, "chat_message", messages, lambda m: m.thread_id, chat_message_cold_row),
+    }
+
+@app.cli.command("archive-cold")
+def archive_cold_command():
+    """Mueve notificaciones y mensajes antiguos a segmentos fríos comprimidos (para cron)."""
+    db = SessionLocal.session_factory()
+    try:
+        print(archive_cold(db))
+    finally:
+        db.close()
+
+def cold_rows(db, kind: str, owner_id: int, *, after_id: int = 0, before_id: int | None = None,
+              limit: int, ascending: bool) -> list[dict]:
+    """Hasta `limit` filas frías del dueño con after_id < id < before_id, en el orden pedido."""
+    q = db.query(ColdSegment.id, ColdSegment.min_id, ColdSegment.max_id, ColdSegment.row_count).filter(
+        ColdSegment.kind == kind, ColdSegment.owner_id == owner_id, ColdSegment.max_id > after_id,
+    )
+    if before_id is not None:
+        q = q.filter(ColdSegment.min_id < before_id)
+    q = q.order_by(ColdSegment.min_id.asc() if ascending else ColdSegment.max_id.desc())
+    # qué segmentos hacen falta se decide sólo con el índice: `sure` cuenta las filas de los
+    # segmentos enteros dentro del rango y `bound` acota el id de la fila `limit` de la página
+    needed, sure, bound, reach = [], 0, None, None
+    for seg_id, min_id, max_id, row_count in q.all():
+        if bound is not None and ((ascending and min_id > bound) or (not ascending and max_id < bound)):
+            break  # ordenados por su borde: los siguientes tampoco mejoran la página
+        needed.append(seg_id)
+        if bound is None:
+            # borde más lejano de lo elegido: la fila `limit` no pasa de ahí
+            far = max_id if ascending else min_id
+            reach = far if reach is None else (max(reach, far) if ascending else min(reach, far))
+            if min_id > after_id and (before_id is None or max_id < before_id):
+                sure += row_count
+            if sure >= limit:
+                bound = reach
+    if not needed:
+        return []
+    out = [
+        r
+        for (payload,) in db.query(ColdSegment.payload).filter(ColdSegment.id.in_(needed)).all()
+        for r in json.loads(zlib.decompress(payload))
+        if r["id"] > after_id and (before_id is None or r["id"] < before_id)
+    ]
+    out.sort(key=lambda r: r["id"], reverse=not ascending)
+    return out[:limit]
+
+def merge_cold(db, kind: str, owner_id: int, hot: list[dict], render, *, after_id: int = 0,
+               before_id: int | None = None, limit: int, ascending: bool) -> list[dict]:
+    """
+    Completa una página caliente (ya ordenada, <= limit, dicts con "id") con las filas frías
+    del mismo rango. Frías y calientes se intercalan (lo no leído / no visto sigue caliente),
+    así que siempre se mira el índice de segmentos; con la página llena sólo cuentan las frías
+    entre el cursor y su borde, y si no hay ninguna no se lee ningún payload.
+    """
+    if limit <= 0:
+        return hot
+    if len(hot) >= limit:
+        edge = hot[-1]["id"]
+        if ascending:
+            before_id = edge if before_id is None else min(before_id, edge)
+        else:
+            after_id = max(after_id, edge)
+    cold = cold_rows(db, kind, owner_id, after_id=after_id, before_id=before_id, limit=limit, ascending=ascending)
+    if not cold:
+        return hot
+    rows = hot + [render(r) for r in cold]
+    rows.sort(key=lambda r: r["id"], reverse=not ascending)
+    return rows[:limit]
+
+# =========================
+# Clientes salientes (FCM, DashScope, OAuth)
+# =========================
+OUTBOUND_POOL_SIZE = int(os.getenv("OUTBOUND_POOL_SIZE", "10"))
+TOKEN_REFRESH_MARGIN = timedelta(seconds=int(os.getenv("TOKEN_REFRESH_MARGIN_SECONDS", "300")))
+
+class OutboundClients:
+    """
+    Una requests.Session keep-alive por upstream ("fcm", "dashscope", "google_oauth"),
+    creada una sola vez y compartida entre hilos. Las estadísticas salen de los
+    contadores de urllib3: requests enviados vs. conexiones nuevas abiertas.
+    """
+    def __init__(self, pool_size: int = OUTBOUND_POOL_SIZE):
+        self._pool_size = pool_size
+        self._lock = threading.Lock()
+        self._sessions: dict[str, requests.Session] = {}
+
+    def session(self, name: str, pool_size: int | None = None) -> requests.Session:
+        sess = self._sessions.get(name)
+        if sess is None:
+            with self._lock:
+                sess = self._sessions.get(name)
+                if sess is None:
+                    sess = requests.Session()
+                    size = max(pool_size or 0, self._pool_size)
+                    sess.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=size))
+                    self._sessions[name] = sess
+        return sess
+
+    def stats(self) -> dict:
+        out = {}
+        for name, sess in list(self._sessions.items()):
+            reqs = conns = 0
+            pools = sess.get_adapter("https://").poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    reqs += pool.num_requests
+                    conns += pool.num_connections
+            out[name] = {"requests": reqs, "new_connections": conns, "reused": max(reqs - conns, 0)}
+        return out
+
+class CachedCredentials:
+    """
+    Access token OAuth2 cacheado hasta TOKEN_REFRESH_MARGIN antes de su expiración.
+    Un solo refresh a la vez: el resto de los hilos espera el lock y reutiliza el resultado.
+    """
+    def __init__(self, loader):
+        self._loader = loader
+        self._creds = None
+        self._lock = threading.Lock()
+        self.refreshes = 0
+        self.hits = 0
+
+    def _fresh(self, creds) -> bool:
+        # google-auth guarda expiry como datetime UTC naive
+        return bool(creds and creds.token and creds.expiry
+                    and creds.expiry - TOKEN_REFRESH_MARGIN > datetime.utcnow())
+
+    def token(self) -> str:
+        creds = self._creds
+        if self._fresh(creds):
+            self.hits += 1
+            return creds.token
+        with self._lock:
+            if self._creds is None:
+                self._creds = self._loader()  # lee el JSON del service account una sola vez
+            creds = self._creds
+            if self._fresh(creds):
+                self.hits += 1
+            else:
+                creds.refresh(Request(session=outbound.session("google_oauth")))
+                self.refreshes += 1
+            return creds.token
+
+    def invalidate(self):
+        """Fuerza refresh en el próximo uso (p.ej. FCM respondió 401)."""
+        with self._lock:
+            if self._creds is not None:
+                self._creds.token = None
+
+    def stats(self) -> dict:
+        creds = self._creds
+        return {
+            "refreshes": self.refreshes,
+            "cache_hits": self.hits,
+            "expires_at": creds.expiry.isoformat() if creds and creds.expiry else None,
+        }
+
+outbound = OutboundClients()
+google_credentials = CachedCredentials(
+    lambda: service_account.Credentials.from_service_account_file(
         os.environ["GOOGLE_APPLICATION_CREDENTIALS"],
         scopes=SCOPES
     )
-    creds.refresh(Request())
-    return creds.token
+)
 
-def _fcm_send(tokens: list[str], title: str, body: str, data: dict | None = None):
+# =========================
+# Notificaciones
+# =========================
+def _get_access_token():
     """
-    Envía notificaciones con FCM. Intenta HTTP v1; si no hay credencial, usa Legacy Server Key.
+    Access token OAuth2 del Service Account para llamar FCM HTTP v1 (cacheado).
+    Requiere GOOGLE_APPLICATION_CREDENTIALS apuntando al JSON del service account.
     """
-    if not tokens:
-        return
+    return google_credentials.token()
+
+FCM_V1_URL = f"https://fcm.googleapis.com/v1/projects/{FIREBASE_PROJECT_ID}/messages:send"
+FCM_LEGACY_URL = "https://fcm.googleapis.com/fcm/send"
+FCM_MAX_WORKERS = int(os.getenv("FCM_MAX_WORKERS", "8"))     # envíos HTTP concurrentes
+FCM_MAX_RETRIES = int(os.getenv("FCM_MAX_RETRIES", "3"))     # reintentos ante 429/5xx
+FCM_TIMEOUT = float(os.getenv("FCM_TIMEOUT", "10"))
+FCM_RETRY_STATUS = {429, 500, 502, 503, 504}
+FCM_LEGACY_BATCH = 1000  # máximo de registration_ids por request legacy
+FCM_MAX_RETRY_AFTER = float(os.getenv("FCM_MAX_RETRY_AFTER", "30"))  # tope de espera por reintento (s)
+
+def retry_after_seconds(value: str | None) -> float:
+    """Retry-After en segundos: acepta delta-seconds o HTTP-date (RFC 9110); 0 si no se entiende."""
+    if not value:
+        return 0.0
+    try:
+        seconds = float(value)
+        return seconds if seconds > 0 else 0.0  # también descarta NaN
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return 0.0
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+class PushDispatcher:
+    """
+    Envía pushes FCM fuera del request que los origina.
+    - La sesión keep-alive "fcm" de outbound, con pool del tamaño de la concurrencia.
+    - Todos los tokens de un usuario en paralelo (acotado por FCM_MAX_WORKERS).
+    - Reintento con backoff exponencial (respeta Retry-After) ante 429/5xx/errores de red.
+    - Borra de device_tokens los tokens que FCM reporta como UNREGISTERED/INVALID.
+    HTTP v1 ya no tiene endpoint batch: se envía 1 request por token sobre conexiones reutilizadas.
+    """
+    def __init__(self, max_workers: int = FCM_MAX_WORKERS):
+        self.http = outbound.session("fcm", pool_size=max_workers)
+        self._jobs = ThreadPoolExecutor(max_workers=2, thread_name_prefix="push-job")
+        self._sends = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="push-send")
 
-    # --- Preferir HTTP v1 si hay service account ---
-    if os.getenv("GOOGLE_APPLICATION_CREDENTIALS"):
+    def dispatch(self, tokens: list[str], title: str, body: str, data: dict | None = None):
+        """No bloquea: encola el envío y la limpieza de tokens muertos."""
+        if tokens:
+            self._jobs.submit(self._run, list(tokens), title, body, data)
+
+    def _run(self, tokens, title, body, data):
         try:
-            access_token = _get_access_token()
-            url = f"https://fcm.googleapis.com/v1/projects/{FIREBASE_PROJECT_ID}/messages:send"
-            headers = {
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json",
-            }
-            # v1 -> 1 request por token (o usa topics en el futuro)
-            for t in tokens:
-                payload = {
-                    "message": {
-                        "token": t,
-                        "notification": {"title": title, "body": body},
-                        "data": (data or {})
-                    }
-                }
-                try:
-                    requests.post(url, headers=headers, json=payload, timeout=10)
-                except Exception as e:
-                    print("FCM v1 error:", e)
-            return
+            dead = self.send(tokens, title, body, data)
+            if dead:
+                prune_device_tokens(dead)
         except Exception as e:
-            print("FCM v1 unavailable, falling back to Legacy:", e)
+            print("FCM dispatch error:", e)
 
-    # --- Fallback Legacy (lo que ya usabas) ---
-    key = os.getenv("FCM_SERVER_KEY")  # si mantienes soporte legacy
-    if not key:
-        # sin v1 y sin legacy -> no enviar
-        print("FCM: faltan credenciales (ni GOOGLE_APPLICATION_CREDENTIALS ni FCM_SERVER_KEY)")
-        return
+    def send(self, tokens: list[str], title: str, body: str, data: dict | None = None) -> list[str]:
+        """Envía (bloqueante) y devuelve la lista de tokens muertos."""
+        if not tokens:
+            return []
+        # FCM exige data como map<string,string>
+        data = {k: str(v) for k, v in (data or {}).items()}
 
-    payload = {
-        "registration_ids": tokens,
-        "notification": {"title": title, "body": body},
-        "data": data or {}
-    }
+        # --- Preferir HTTP v1 si hay service account ---
+        if os.getenv("GOOGLE_APPLICATION_CREDENTIALS"):
+            try:
+                access_token = _get_access_token()
+            except Exception as e:
+                print("FCM v1 unavailable, falling back to Legacy:", e)
+            else:
+                headers = {
+                    "Authorization": f"Bearer {access_token}",
+                    "Content-Type": "application/json",
+                }
+                futures = [
+                    self._sends.submit(self._send_v1, headers, t, title, body, data)
+                    for t in tokens
+                ]
+                return [t for t, f in zip(tokens, futures) if f.result()]
+
+        # --- Fallback Legacy (lo que ya usabas) ---
+        key = os.getenv("FCM_SERVER_KEY")  # si mantienes soporte legacy
+        if not key:
+            # sin v1 y sin legacy -> no enviar
+            print("FCM: faltan credenciales (ni GOOGLE_APPLICATION_CREDENTIALS ni FCM_SERVER_KEY)")
+            return []
+        headers = {"Authorization": f"key {key}", "Content-Type": "application/json"}
+        dead = []
+        for i in range(0, len(tokens), FCM_LEGACY_BATCH):
+            dead += self._send_legacy(headers, tokens[i:i + FCM_LEGACY_BATCH], title, body, data)
+        return dead
+
+    def _post(self, url, headers, payload):
+        """POST con reintentos; devuelve la última respuesta (o None si nunca hubo)."""
+        resp = None
+        for attempt in range(FCM_MAX_RETRIES + 1):
+            try:
+                resp = self.http.post(url, headers=headers, json=payload, timeout=FCM_TIMEOUT)
+                if resp.status_code not in FCM_RETRY_STATUS:
+                    return resp
+                delay = retry_after_seconds(resp.headers.get("Retry-After"))
+            except requests.RequestException as e:
+                print("FCM request error:", e)
+                delay = 0
+            if attempt < FCM_MAX_RETRIES:
+                sleep(min(max(delay, 0.5 * 2 ** attempt), FCM_MAX_RETRY_AFTER) + random.uniform(0, 0.25))
+        return resp
+
+    def _send_v1(self, headers, token, title, body, data) -> bool:
+        """True si el token está muerto."""
+        payload = {
+            "message": {
+                "token": token,
+                "notification": {"title": title, "body": body},
+                "data": data,
+            }
+        }
+        resp = self._post(FCM_V1_URL, headers, payload)
+        if resp is not None and resp.status_code == 401:
+            # token OAuth revocado/expirado antes de tiempo: refresca y reintenta una vez
+            google_credentials.invalidate()
+            headers = {**headers, "Authorization": f"Bearer {_get_access_token()}"}
+            resp = self._post(FCM_V1_URL, headers, payload)
+        if resp is None or resp.ok:
+            return False
+        try:
+            err = resp.json().get("error") or {}
+        except ValueError:
+            err = {}
+        codes = {d.get("errorCode") for d in (err.get("details") or []) if isinstance(d, dict)}
+        if "UNREGISTERED" in codes:
+            return True
+        if "INVALID_ARGUMENT" in codes and "registration token" in (err.get("message") or "").lower():
+            return True
+        print("FCM v1 error:", resp.status_code, err.get("message"))
+        return False
+
+    def _send_legacy(self, headers, tokens, title, body, data) -> list[str]:
+        payload = {
+            "registration_ids": tokens,
+            "notification": {"title": title, "body": body},
+            "data": data,
+        }
+        resp = self._post(FCM_LEGACY_URL, headers, payload)
+        if resp is None or not resp.ok:
+            print("FCM legacy error:", getattr(resp, "status_code", None))
+            return []
+        try:
+            results = resp.json().get("results") or []
+        except ValueError:
+            return []
+        return [
+            t for t, r in zip(tokens, results)
+            if r.get("error") in ("NotRegistered", "InvalidRegistration")
+        ]
+
+def prune_device_tokens(tokens: list[str]):
+    """Elimina tokens que FCM ya no acepta (sesión propia: corre fuera del request)."""
+    db = SessionLocal.session_factory()
     try:
-        requests.post(
-            "https://fcm.googleapis.com/fcm/send",
-            headers={"Authorization": f"key {key}", "Content-Type": "application/json"},
-            json=payload, timeout=10
-        )
-    except Exception as e:
-        print("FCM legacy error:", e)
+        db.query(DeviceToken).filter(DeviceToken.token.in_(tokens)).delete(synchronize_session=False)
+        db.commit()
+        print(f"FCM: {len(tokens)} token(s) muertos eliminados")
+    finally:
+        db.close()
+
+push = PushDispatcher()
+
 def send_notification(db, user_id: int, ntype: str, title: str, body: str, *, data: dict | None = None):
     # 1) Guarda en DB
     n = Notification(
         user_id=user_id, type=ntype, title=title, body=body,
         data_json=json.dumps(data or {})
     )
-    db.add(n); db.commit()
+    db.add(n)
+    db.query(User).filter(User.id == user_id).update(
+        {User.unread_notifications: User.unread_notifications + 1}, synchronize_session=False
+    )
+    db.commit()
 
-    # 2) Push FCM (si hay tokens)
-    tokens = [t.token for t in db.query(DeviceToken).filter(DeviceToken.user_id == user_id).all()]
-    try:
-        _fcm_send(tokens, title, body, {"type": ntype, **(data or {})})
-    except Exception:
-        pass
+    # 2) Push FCM (si hay tokens), en segundo plano
+    tokens = [t for (t,) in db.query(DeviceToken.token).filter(DeviceToken.user_id == user_id).all()]
+    push.dispatch(tokens, title, body, {"type": ntype, **(data or {})})
 
-    # 3) Empuja por SSE (canal de notificaciones)
-    try:
-        # Para SSE “fire-and-forget”: no necesitamos nada si el cliente tira long-poll cada Xs,
-        # pero si implementas un pub/sub real, emite aquí.
-        pass
-    except:
-        pass
+    # 3) Despierta los streams SSE del destinatario
+    broker.publish(notifications_channel(user_id))
     return n.id
 @app.post("/pns/register_token")
 @jwt_required()
@@ -443,26 +1682,72 @@ def pns_debug_tokens():
     finally:
         db.close()
 
+@app.get("/debug/outbound")
+@jwt_required()
+def debug_outbound():
+    """Estadísticas de clientes salientes: OAuth, conexiones, cola de @tink y cache de IA."""
+    return jsonify({
+        "oauth": google_credentials.stats(),
+        "http": outbound.stats(),
+        "bot_jobs": bot_jobs.stats(),
+        "ai_cache": ai_cache.stats(),
+    })
+
+NOTIFICATIONS_PAGE_SIZE = 100
+NOTIFICATIONS_PAGE_MAX = 200
+
 @app.get("/notifications")
 @jwt_required()
 def notifications_list():
+    """
+    Query: ?unread_only=1&before_id=<id>&limit=<int>&compact=1
+    Más nuevas primero; la página siguiente se pide con before_id = id más bajo recibido.
+    compact=1 omite "data" (no se lee ni decodifica data_json).
+    """
     db = get_db()
     try:
         uid = int(get_jwt_identity())
         unread_only = request.args.get("unread_only", default=0, type=int) == 1
-        q = db.query(Notification).filter(Notification.user_id == uid).order_by(Notification.id.desc())
+        before_id = request.args.get("before_id", type=int)
+        compact = request.args.get("compact", default=0, type=int) == 1
+        limit = request.args.get("limit", default=NOTIFICATIONS_PAGE_SIZE, type=int)
+        limit = max(1, min(limit, NOTIFICATIONS_PAGE_MAX))
+
+        q = db.query(Notification).filter(Notification.user_id == uid)
         if unread_only:
             q = q.filter(Notification.read == False)
-        rows = q.limit(100).all()
-        return jsonify([{
-            "id": r.id,
-            "type": r.type,
-            "title": r.title,
-            "body": r.body,
-            "data": json.loads(r.data_json) if r.data_json else {},
-            "read": r.read,
-            "created_at": r.created_at.isoformat()
-        } for r in rows])
+        if before_id:
+            q = q.filter(Notification.id < before_id)
+        if not compact:
+            q = q.options(undefer(Notification.data_json))
+        rows = q.order_by(Notification.id.desc()).limit(limit).all()
+        ser = NOTIFICATION_COMPACT_JSON if compact else NOTIFICATION_JSON
+        out = [ser(r) for r in rows]
+
+        if not unread_only:  # en frío sólo hay leídas
+            def render(c):
+                item = {k: c[k] for k in ("id", "type", "title", "body", "read", "created_at")}
+                if not compact:
+                    item["data"] = json.loads(c["data_json"]) if c["data_json"] else {}
+                return item
+            out = merge_cold(db, "notification", uid, out, render,
+                             before_id=before_id, limit=limit, ascending=False)
+        return jsonify(out)
+    finally:
+        db.close()
+
+@app.get("/notifications/unread_count")
+@jwt_required()
+def notifications_unread_count():
+    """Badge: contador mantenido, sin recorrer la tabla notifications."""
+    db = get_db()
+    try:
+        unread = (
+            db.query(User.unread_notifications)
+              .filter(User.id == int(get_jwt_identity()))
+              .scalar()
+        )
+        return jsonify({"unread": int(unread or 0)})
     finally:
         db.close()
 
@@ -470,24 +1755,41 @@ def notifications_list():
 @app.post("/notifications/mark_read")
 @jwt_required()
 def notifications_mark_read():
+    """
+    body: { "ids": [1, 2, 3] }   marca esas
+       o: { "up_to_id": 42 }     marca todas las <= 42 (watermark: "marcar todo como leído")
+    """
     data = request.get_json(force=True) or {}
     ids = data.get("ids") or []
-    if not isinstance(ids, list) or not ids:
-        return jsonify({"msg": "ids[] requerido"}), 400
+    up_to_id = data.get("up_to_id")
+    if up_to_id is None and (not isinstance(ids, list) or not ids):
+        return jsonify({"msg": "ids[] o up_to_id requerido"}), 400
+    try:
+        up_to_id = int(up_to_id) if up_to_id is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"msg": "up_to_id inválido"}), 400
 
     db = get_db()
     try:
         uid = int(get_jwt_identity())
-        db.query(Notification).filter(
-            Notification.user_id == uid,
-            Notification.id.in_(ids)
-        ).update({Notification.read: True}, synchronize_session=False)
+        q = db.query(Notification).filter(Notification.user_id == uid, Notification.read == False)
+        if up_to_id is not None:
+            q = q.filter(Notification.id <= up_to_id)
+        else:
+            q = q.filter(Notification.id.in_(ids))
+        changed = q.update({Notification.read: True}, synchronize_session=False)
+        if changed:
+            db.query(User).filter(User.id == uid).update(
+                {User.unread_notifications: User.unread_notifications - changed}, synchronize_session=False
+            )
         db.commit()
-        return jsonify({"msg": "ok"})
+        unread = db.query(User.unread_notifications).filter(User.id == uid).scalar()
+        return jsonify({"msg": "ok", "marked": changed, "unread": int(unread or 0)})
     finally:
         db.close()
 
 @app.get("/notifications/sse")
+@primary_db  # se despierta tras un commit en el primario: la réplica puede no tenerlo aún
 def notifications_sse():
     token = request.args.get("token")
     if token and not request.headers.get("Authorization"):
@@ -498,7 +1800,6 @@ def notifications_sse():
     def event_stream():
         db = get_db()
         try:
-            from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
             try:
                 verify_jwt_in_request()
             except Exception:
@@ -508,39 +1809,24 @@ def notifications_sse():
             uid = int(get_jwt_identity())
             last_id = request.args.get("last_id", type=int) or 0
 
-            while True:
-                rows = (
-                    db.query(Notification)
-                    .filter(Notification.user_id == uid, Notification.id > last_id)
-                    .order_by(Notification.id.asc())
-                    .all()
-                )
-                for r in rows:
-                    payload = {
-                        "id": r.id,
-                        "type": r.type,
-                        "title": r.title,
-                        "body": r.body,
-                        "data": json.loads(r.data_json) if r.data_json else {},
-                        "created_at": r.created_at.isoformat()
-                    }
-                    yield f"event: notification\ndata: {json.dumps(payload)}\n\n"
-                    last_id = r.id
-                sleep(1.0)
+            # suscribe ANTES de la primera lectura para no perder avisos intermedios
+            sub = broker.subscribe(notifications_channel(uid))
+            try:
+                while True:
+                    rows = notifications_after(db, uid, last_id)
+                    db.close()  # libera la conexión mientras esperamos
+                    for r in rows:
+                        yield sse_event("notification", notification_payload(r))
+                        last_id = r.id
+                    # sin consultas mientras no haya publicaciones; keepalive para detectar desconexión
+                    while not sub.wait(SSE_KEEPALIVE_SECONDS):
+                        yield ": keepalive\n\n"
+            finally:
+                sub.close()
         finally:
             db.close()
     return Response(event_stream(), mimetype="text/event-stream")
-def check_overlap(db, artist_id: int, start_time: datetime, end_time: datetime) -> bool:
-    q = (
-        db.query(Appointment)
-        .filter(
-            Appointment.artist_id == artist_id,
-            Appointment.status.notin_(["canceled", "rejected"]),  # ← ocupado si no está cancelada/rechazada
-            Appointment.start_time < end_time,
-            Appointment.end_time > start_time,
-        )
-    )
-    return db.query(q.exists()).scalar()
+
 @app.post("/appointments/<int:appointment_id>/confirm")
 @role_required("artist")
 def confirm_appointment(appointment_id):
@@ -554,6 +1840,8 @@ def confirm_appointment(appointment_id):
 
         appt.status = "confirmed"
         db.commit()
+        artist_stats.invalidate(appt.artist_id)
+        http_cache.bump(("appointment", appt.id), ("artist", appt.artist_id))
 
         # Notificación al CLIENTE
         try:
@@ -585,6 +1873,9 @@ def reject_appointment(appointment_id):
 
         appt.status = "rejected"
         db.commit()
+        artist_stats.invalidate(appt.artist_id)
+        availability.invalidate(appt.artist_id)
+        http_cache.bump(("appointment", appt.id), ("artist", appt.artist_id))
 
         # Notificación al CLIENTE
         try:
@@ -614,7 +1905,7 @@ def chat_ensure_thread():
     """
     db = get_db()
     try:
-        me = db.get(User, int(get_jwt_identity()))
+        me = current_user()
         if not me:
             return jsonify({"msg":"No autorizado"}), 401
 
@@ -636,6 +1927,8 @@ def chat_ensure_thread():
         db.close()
 
 
+CHAT_THREADS_PAGE_MAX = 200
+
 @app.get("/chat/threads")
 @jwt_required()
 def chat_list_threads():
@@ -645,72 +1938,67 @@ def chat_list_threads():
     """
     db = get_db()
     try:
-        me = db.get(User, int(get_jwt_identity()))
+        me = current_user()
         if not me:
             return jsonify({"msg": "No autorizado"}), 401
 
+        # Una sola consulta: hilos del usuario + datos del "otro" participante.
+        # Paginación opcional: ?limit=<int>&cursor=<X-Next-Cursor de la página anterior>
+        limit = request.args.get("limit", type=int)
+        try:
+            cursor = decode_cursor(request.args.get("cursor"))
+            if cursor:
+                cursor = (parse_dt(cursor[0]), int(cursor[1]))
+        except (ValueError, TypeError, IndexError):
+            return jsonify({"msg": "cursor inválido"}), 400
+
+        other_id = case((ChatThread.artist_id == me.id, ChatThread.client_id), else_=ChatThread.artist_id)
         q = (
-            db.query(ChatThread)
-              .filter((ChatThread.artist_id == me.id) | (ChatThread.client_id == me.id))
-              .order_by(ChatThread.updated_at.desc())
+            db.query(ChatThread, User.name, User.email)
+              .outerjoin(User, User.id == other_id)
+              .filter(or_(ChatThread.artist_id == me.id, ChatThread.client_id == me.id))
         )
+        if cursor:
+            q = q.filter(or_(
+                ChatThread.updated_at < cursor[0],
+                and_(ChatThread.updated_at == cursor[0], ChatThread.id < cursor[1]),
+            ))
+        q = q.order_by(ChatThread.updated_at.desc(), ChatThread.id.desc())
+        if limit:
+            limit = max(1, min(limit, CHAT_THREADS_PAGE_MAX))
+            rows = q.limit(limit + 1).all()
+        else:
+            rows = q.all()
 
-        out = []
-        for th in q.all():
-            # último mensaje del hilo (si existe)
-            last = (
-                db.query(ChatMessage)
-                  .filter(ChatMessage.thread_id == th.id)
-                  .order_by(ChatMessage.id.desc())
-                  .first()
-            )
-
-            # calcula "unread" en función del rol actual (sin tocar tu lógica)
-            if me.role == "artist":
-                unread = (
-                    db.query(ChatMessage)
-                      .filter(
-                          ChatMessage.thread_id == th.id,
-                          ChatMessage.sender_id != me.id,
-                          ChatMessage.seen_by_artist == False,  # o .is_(False) si prefieres
-                      )
-                      .count()
-                )
-                other_id = th.client_id
-            else:
-                unread = (
-                    db.query(ChatMessage)
-                      .filter(
-                          ChatMessage.thread_id == th.id,
-                          ChatMessage.sender_id != me.id,
-                          ChatMessage.seen_by_client == False,  # o .is_(False)
-                      )
-                      .count()
-                )
-                other_id = th.artist_id
-
-            # NUEVO: datos del "otro" usuario
-            other = db.get(User, other_id)
-            other_name = other.name if other else None
-            other_email = other.email if other else None
+        next_cursor = None
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1][0]
+            next_cursor = encode_cursor(last.updated_at, last.id)
 
+        out = []
+        for th, other_name, other_email in rows:
+            mine_is_artist = (me.id == th.artist_id)
             out.append({
                 "thread_id": th.id,
-                "other_user_id": other_id,
-                "other_user_name": other_name,        # <- añadido
-                "other_user_email": other_email,      # <- opcional
+                "other_user_id": th.client_id if mine_is_artist else th.artist_id,
+                "other_user_name": other_name,
+                "other_user_email": other_email,
                 "last_message": ({
-                    "id": last.id,
-                    "text": last.text,
-                    "image_url": last.image_url,
-                    "sender_id": last.sender_id,
-                    "created_at": last.created_at.isoformat(),
-                } if last else None),
-                "unread": unread,
+                    "id": th.last_message_id,
+                    "text": th.last_message_preview,
+                    "image_url": th.last_message_image_url,
+                    "sender_id": th.last_message_sender_id,
+                    "created_at": th.last_message_at.isoformat() if th.last_message_at else None,
+                } if th.last_message_id else None),
+                "unread": th.unread_artist if mine_is_artist else th.unread_client,
                 "updated_at": th.updated_at.isoformat(),
             })
 
-        return jsonify(out)
+        resp = jsonify(out)
+        if next_cursor:
+            resp.headers["X-Next-Cursor"] = next_cursor
+        return resp
     finally:
         db.close()
 
@@ -721,11 +2009,12 @@ def chat_list_threads():
 def chat_get_messages(thread_id):
     """
     Query: ?after_id=<int>&limit=<int default=50>
-    Devuelve mensajes ASC (antiguo->nuevo).
+           ?before_id=<int>&limit=...   los `limit` anteriores a before_id (paginar hacia atrás)
+    Devuelve mensajes ASC (antiguo->nuevo). El histórico archivado en frío se lee igual.
     """
     db = get_db()
     try:
-        me = db.get(User, int(get_jwt_identity()))
+        me = current_user()
         th = db.get(ChatThread, thread_id)
         if not me or not th:
             return jsonify({"msg":"No autorizado o hilo no existe"}), 404
@@ -733,22 +2022,26 @@ def chat_get_messages(thread_id):
             return jsonify({"msg":"No perteneces a este hilo"}), 403
 
         after_id = request.args.get("after_id", type=int)
+        before_id = request.args.get("before_id", type=int)
         limit = request.args.get("limit", default=50, type=int)
 
         q = db.query(ChatMessage).filter(ChatMessage.thread_id == thread_id)
         if after_id:
             q = q.filter(ChatMessage.id > after_id)
-        msgs = q.order_by(ChatMessage.id.asc()).limit(limit).all()
-
-        return jsonify([
-            {
-                "id": m.id,
-                "sender_id": m.sender_id,
-                "text": m.text,
-                "image_url": m.image_url,
-                "created_at": m.created_at.isoformat()
-            } for m in msgs
-        ])
+        if before_id:
+            q = q.filter(ChatMessage.id < before_id)
+        backwards = bool(before_id)
+        q = q.order_by(ChatMessage.id.desc() if backwards else ChatMessage.id.asc())
+        out = [chat_message_payload(m) for m in q.limit(limit).all()]
+
+        def render(c):
+            return {**{k: c[k] for k in ("id", "sender_id", "text", "image_url", "created_at")},
+                    **image_store.variants(c["image_url"])}
+        out = merge_cold(db, "chat_message", thread_id, out, render, after_id=after_id or 0,
+                         before_id=before_id, limit=limit, ascending=not backwards)
+        if backwards:
+            out.reverse()
+        return jsonify(out)
     finally:
         db.close()
 
@@ -758,7 +2051,7 @@ def chat_get_messages(thread_id):
 def chat_send_message(thread_id):
     db = get_db()
     try:
-        me = db.get(User, int(get_jwt_identity()))
+        me = current_user()
         data = request.get_json(force=True) or {}
         text = (data.get("text") or "").strip()
         image_url = data.get("image_url")
@@ -776,8 +2069,10 @@ def chat_send_message(thread_id):
             created_at=datetime.now(timezone.utc)
         )
         db.add(msg)
-        th.updated_at = datetime.now(timezone.utc)
+        db.flush()
+        apply_message_to_thread(th, msg)
         db.commit()  # ← HOOK del bot parte después de guardar el mensaje del usuario
+        broker.publish(chat_channel(th.id))
 
         # 🔔 Notificación a la contraparte (si el emisor NO es el bot)
         other_id = th.client_id if me.id == th.artist_id else th.artist_id
@@ -796,96 +2091,28 @@ def chat_send_message(thread_id):
                 # Evita que un fallo de notificación afecte al flujo de chat
                 pass
 
-        # --- BOT @tink ---
+        # --- BOT @tink --- (en segundo plano; su respuesta llega por el SSE del hilo)
+        bot_job = None
         if text and "@tink" in text.lower():
             bot = ensure_bot_user(db)  # crea/obtiene al usuario 'tink'
             if me.id != bot.id:        # evita loops
-
-                def _looks_like_image_prompt(t: str) -> bool:
-                    t = (t or "").lower()
-                    triggers = ["img ", "/img", "imagen", "genera una imagen", "generar imagen", "hazme una imagen", "dibuja"]
-                    return any(k in t for k in triggers)
-
-                bot_text = None
-
-                if _looks_like_image_prompt(text):
-                    # === Generación de imagen vía Qwen, igualando a chatbot.py ===
-                    key = os.getenv("DASHSCOPE_API_KEY") or os.getenv("QWEN_API_KEY")
-                    if not key:
-                        bot_text = "(@tink) Falta DASHSCOPE_API_KEY en el .env para generar imágenes."
-                    else:
-                        region = (os.getenv("DASHSCOPE_REGION") or "intl").lower()
-                        gen_endpoint = (
-                            "https://dashscope-intl.aliyuncs.com/api/v1/services/aigc/multimodal-generation/generation"
-                            if region == "intl"
-                            else "https://dashscope.aliyuncs.com/api/v1/services/aigc/multimodal-generation/generation"
-                        )
-                        try:
-                            resp = requests.post(
-                                gen_endpoint,
-                                headers={"Authorization": f"Bearer {key}", "Content-Type": "application/json"},
-                                json={
-                                    "model": "qwen-image-plus",
-                                    "input": {"messages": [{"role": "user", "content": [{"text": text}]}]},
-                                    "parameters": {
-                                        "size": "1328*1328",
-                                        "negative_prompt": "",
-                                        "watermark": False,
-                                        "prompt_extend": True
-                                    },
-                                },
-                                timeout=120
-                            )
-                            data = resp.json()
-                            resp.raise_for_status()
-
-                            # Extrae URLs (dos posibles formas de salida)
-                            urls = []
-                            out = (data or {}).get("output") or {}
-                            if "results" in out:
-                                for r in out.get("results", []):
-                                    u = r.get("url") or r.get("image")
-                                    if u:
-                                        urls.append(u)
-                            if "choices" in out:
-                                for ch in out.get("choices", []):
-                                    msgc = ch.get("message") or {}
-                                    for c in (msgc.get("content") or []):
-                                        if isinstance(c, dict) and c.get("image"):
-                                            urls.append(c["image"])
-
-                            if urls:
-                                bot_text = "(@tink) Imagen lista:\n" + "\n".join(urls)
-                            else:
-                                bot_text = "(@tink) No recibí URL de imagen en la respuesta."
-                        except Exception as e:
-                            bot_text = f"(@tink) Falló la generación de imagen: {e}"
+                if bot_jobs.submit(me.id, run_tink_job, th.id, bot.id, text):
+                    bot_job = "queued"
                 else:
-                    # Respuesta de texto con Qwen (usa tu qwen_reply existente, idealmente adaptado a DASHSCOPE_*)
-                    try:
-                        bot_text = qwen_reply(text)
-                    except Exception:
-                        bot_text = "(@tink) Problemas con el asistente ahora mismo."
-
-                # Inserta el mensaje del bot
-                bot_msg = ChatMessage(
-                    thread_id=th.id,
-                    sender_id=bot.id,
-                    text=bot_text,
-                    created_at=datetime.now(timezone.utc)
-                )
-                db.add(bot_msg)
-                th.updated_at = datetime.now(timezone.utc)
-                db.commit()
+                    bot_job = "busy"
+                    post_bot_message(db, th, bot.id, "(@tink) Estoy con muchas solicitudes, intenta de nuevo en un momento.")
 
         # Respuesta del endpoint: el mensaje del usuario
-        return jsonify({
+        out = {
             "id": msg.id,
             "text": msg.text,
             "image_url": msg.image_url,
             "sender_id": msg.sender_id,
             "created_at": msg.created_at.isoformat()
-        }), 201
+        }
+        if bot_job:
+            out["bot_job"] = bot_job  # queued | busy
+        return jsonify(out), 201
 
     finally:
         db.close()
@@ -900,7 +2127,7 @@ def chat_mark_read(thread_id):
     """
     db = get_db()
     try:
-        me = db.get(User, int(get_jwt_identity()))
+        me = current_user()
         th = db.get(ChatThread, thread_id)
         if not me or not th:
             return jsonify({"msg":"No autorizado o hilo no existe"}), 404
@@ -924,6 +2151,18 @@ def chat_mark_read(thread_id):
                 ChatMessage.id <= last_id,
                 ChatMessage.sender_id != me.id
             ).update({ChatMessage.seen_by_client: True}, synchronize_session=False)
+
+        # recalcula el contador de no leídos de mi lado (mismo commit)
+        seen_col = ChatMessage.seen_by_artist if me.id == th.artist_id else ChatMessage.seen_by_client
+        remaining = (
+            db.query(func.count(ChatMessage.id))
+              .filter(ChatMessage.thread_id == th.id, ChatMessage.sender_id != me.id, seen_col == False)
+              .scalar()
+        ) or 0
+        if me.id == th.artist_id:
+            th.unread_artist = remaining
+        else:
+            th.unread_client = remaining
         db.commit()
         return jsonify({"msg":"ok"})
     finally:
@@ -931,6 +2170,7 @@ def chat_mark_read(thread_id):
 
 
 @app.get("/chat/threads/<int:thread_id>/sse")
+@primary_db
 def chat_sse(thread_id):
     """
     SSE para recibir mensajes nuevos en tiempo (casi) real.
@@ -949,14 +2189,13 @@ def chat_sse(thread_id):
         db = get_db()
         try:
             # valida usuario y pertenencia al hilo
-            from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
             try:
                 verify_jwt_in_request()
             except Exception:
                 yield "event: error\ndata: unauthorized\n\n"
                 return
 
-            me = db.get(User, int(get_jwt_identity()))
+            me = current_user()
             th = db.get(ChatThread, thread_id)
             if not me or not th or me.id not in (th.artist_id, th.client_id):
                 yield "event: error\ndata: forbidden\n\n"
@@ -965,42 +2204,338 @@ def chat_sse(thread_id):
             last_id = request.args.get("last_id", type=int)
             if not last_id:
                 # arranca en el último para no reemitir histórico
-                last = (
-                    db.query(ChatMessage)
-                    .filter(ChatMessage.thread_id == th.id)
-                    .order_by(ChatMessage.id.desc())
-                    .first()
-                )
-                last_id = last.id if last else 0
-
-            # bucle simple (dev). En prod, pasarse a Redis pub/sub o Socket.IO
-            while True:
-                msgs = (
-                    db.query(ChatMessage)
-                    .filter(ChatMessage.thread_id == th.id, ChatMessage.id > last_id)
-                    .order_by(ChatMessage.id.asc())
-                    .all()
-                )
-                for m in msgs:
-                    payload = {
-                        "id": m.id,
-                        "sender_id": m.sender_id,
-                        "text": m.text,
-                        "image_url": m.image_url,
-                        "created_at": m.created_at.isoformat()
-                    }
-                    yield f"event: message\ndata: {jsonify(payload).get_data(as_text=True)}\n\n"
-                    last_id = m.id
-                sleep(1.0)
+                last_id = chat_last_message_id(db, th.id)
+
+            # despertado por el broker (chat_send_message publica tras el commit)
+            sub = broker.subscribe(chat_channel(th.id))
+            try:
+                while True:
+                    msgs = chat_messages_after(db, th.id, last_id)
+                    db.close()  # libera la conexión mientras esperamos
+                    for m in msgs:
+                        yield sse_event("message", chat_message_payload(m))
+                        last_id = m.id
+                    while not sub.wait(SSE_KEEPALIVE_SECONDS):
+                        yield ": keepalive\n\n"
+            finally:
+                sub.close()
         finally:
             db.close()
 
     return Response(event_stream(), mimetype="text/event-stream")
+# =========================
+# Subidas de imágenes
+# =========================
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 64 * 1024
+IMAGE_VARIANTS = {"thumb": 320, "medium": 1024}  # lado mayor en px
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+IMAGE_MAX_POOL_CRASHES = 2  # caídas del pool con la imagen en vuelo antes de darla por fallida
+
+# firma (magic bytes) -> extensión; WEBP se valida aparte (RIFF....WEBP)
+IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpg"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+)
+
+def sniff_image(head: bytes) -> str | None:
+    """Extensión según los primeros bytes, o None si no es una imagen soportada."""
+    for sig, ext in IMAGE_SIGNATURES:
+        if head.startswith(sig):
+            return ext
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+class UploadRejected(Exception):
+    def __init__(self, msg: str, status: int = 400):
+        super().__init__(msg)
+        self.msg = msg
+        self.status = status
+
+class UploadSink:
+    """
+    Escribe una subida a disco por trozos: hashea (sha256) y cuenta mientras escribe,
+    valida la firma con los primeros bytes y corta al pasar UPLOAD_MAX_BYTES.
+    El archivo final se llama <sha256>.<ext>: subir dos veces lo mismo no duplica.
+    """
+    def __init__(self, max_bytes: int = UPLOAD_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.ext = None
+        self._head = b""
+        self._sha = hashlib.sha256()
+        self._tmp = tempfile.NamedTemporaryFile(dir=UPLOAD_DIR, prefix=".upload-", delete=False)
+
+    def write(self, chunk: bytes):
+        if not chunk:
+            return
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise UploadRejected(f"Imagen demasiado grande (máx {self.max_bytes} bytes)", 413)
+        if self.ext is None:
+            self._head += chunk[:16]
+            if len(self._head) >= 12:
+                self.ext = sniff_image(self._head)
+                if self.ext is None:
+                    raise UploadRejected("Formato no soportado (png, jpg, gif, webp)", 415)
+        self._sha.update(chunk)
+        self._tmp.write(chunk)
+
+    def finish(self) -> dict:
+        self._tmp.close()
+        if self.ext is None:
+            self.ext = sniff_image(self._head)  # archivos de menos de 12 bytes
+        if not self.size or self.ext is None:
+            self.abort()
+            raise UploadRejected("Imagen vacía o inválida")
+        sha = self._sha.hexdigest()
+        fname = f"{sha}.{self.ext}"
+        dst = pathlib.Path(UPLOAD_DIR) / fname
+        duplicate = dst.exists()
+        if duplicate:
+            self.abort()  # mismo contenido ya guardado (y sus derivados)
+        else:
+            os.replace(self._tmp.name, dst)
+        return {"filename": fname, "sha256": sha, "size": self.size, "duplicate": duplicate}
+
+    def abort(self):
+        self._tmp.close()
+        try:
+            os.unlink(self._tmp.name)
+        except FileNotFoundError:
+            pass
+
+class ImageStore:
+    """
+    Imágenes propias (archivos de UPLOAD_DIR, por contenido: <sha256>.<ext>) y sus derivados
+    WEBP en UPLOAD_DIR/_v/<archivo>.<variante>.webp, generados en un pool de procesos.
+    variants(url) nunca bloquea: si aún no existen los encarga y devuelve None, y el
+    cliente usa image_url mientras tanto. URLs externas no tienen derivados.
+    """
+    def __init__(self, root: str, sizes: dict[str, int], workers: int):
+        self.root = pathlib.Path(root).absolute()  # los procesos del pool reciben rutas absolutas
+        self.vdir = self.root / "_v"
+        self.sizes = sizes
+        self.workers = workers
+        self.enabled = imaging is not None
+        self._url_dir = UPLOAD_DIR.strip("/")
+        self._lock = threading.Lock()
+        self._pool = None
+        self._ready: set[str] = set()
+        self._pending: set[str] = set()
+        self._failed: set[str] = set()
+        self._crashes: dict[str, int] = {}  # nombre -> veces que estaba en vuelo al romperse el pool
+
+    _NAME_RE = re.compile(r"[\w-][\w.-]*")
+
+    def _url_name(self, url: str | None) -> str | None:
+        """Nombre de archivo si la URL apunta a UPLOAD_DIR (sin tocar el disco)."""
+        if not url:
+            return None
+        path = re.sub(r"/+", "/", urlparse(url).path)
+        head, _, name = path.rpartition("/")
+        if not self._NAME_RE.fullmatch(name) or not head.strip("/").endswith(self._url_dir):
+            return None
+        return name
+
+    def local_name(self, url: str | None) -> str | None:
+        """Nombre del archivo en UPLOAD_DIR si la URL es una subida nuestra."""
+        name = self._url_name(url)
+        return name if name and (self.root / name).is_file() else None
+
+    def _has_files(self, name: str) -> bool:
+        return all((self.vdir / imaging.variant_filename(name, v)).is_file() for v in self.sizes)
+
+    def variants(self, url: str | None) -> dict[str, str | None]:
+        out = {f"{v}_url": None for v in self.sizes}
+        if not self.enabled:
+            return out
+        # se llama por fila al serializar: las ya listas no tocan el disco
+        name = self._url_name(url)
+        if not name:
+            return out
+        if name not in self._ready:
+            if not (self.root / name).is_file():
+                return out
+            if not self._has_files(name):
+                self.schedule(name)
+                return out
+            with self._lock:
+                self._ready.add(name)
+        prefix = url[: len(url) - len(name)]
+        for v in self.sizes:
+            out[f"{v}_url"] = f"{prefix}_v/{imaging.variant_filename(name, v)}"
+        return out
+
+    def schedule(self, name: str):
+        """Encarga los derivados de UPLOAD_DIR/<name> (una vez; sin esperar)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if name in self._ready or name in self._pending or name in self._failed:
+                return
+            self._pending.add(name)
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            pool = self._pool
+        try:
+            fut = pool.submit(imaging.make_variants, str(self.root / name), str(self.vdir), name, self.sizes)
+        except Exception as e:  # pool roto: se recrea en el próximo encargo
+            self._reset(pool, name, e)
+            return
+        fut.add_done_callback(lambda f: self._done(pool, name, f))
+
+    def _done(self, pool, name: str, fut):
+        err = fut.exception()
+        if isinstance(err, BrokenProcessPool):
+            return self._reset(pool, name, err)
+        with self._lock:
+            self._pending.discard(name)
+            self._crashes.pop(name, None)
+            (self._failed if err else self._ready).add(name)
+        if err:
+            print(f"[images] derivados de {name} fallaron: {err!r}")
+        else:
+            http_cache.bump("media")  # las listas cacheadas pasan a traer thumb_url/medium_url
+
+    def _reset(self, pool, name: str, err: Exception):
+        # una imagen que tumba al worker lo haría en cada listado: tras IMAGE_MAX_POOL_CRASHES
+        # caídas no se vuelve a encargar (las que sólo estaban en vuelo tienen otro intento)
+        with self._lock:
+            self._pending.discard(name)
+            crashes = self._crashes.get(name, 0) + 1
+            if crashes >= IMAGE_MAX_POOL_CRASHES:
+                self._crashes.pop(name, None)
+                self._failed.add(name)
+            else:
+                self._crashes[name] = crashes
+            if self._pool is pool:
+                self._pool = None
+        if crashes >= IMAGE_MAX_POOL_CRASHES:
+            print(f"[images] pool de derivados caído ({err!r}); {name} se da por fallida tras {crashes} caídas")
+        else:
+            print(f"[images] pool de derivados caído ({err!r}); se reintentará {name}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"enabled": self.enabled, "ready": len(self._ready),
+                    "pending": len(self._pending), "failed": len(self._failed)}
+
+image_store = ImageStore(UPLOAD_DIR, IMAGE_VARIANTS, IMAGE_WORKERS)
+
+@app.cli.command("build-image-variants")
+def build_image_variants_command():
+    """Genera (en este proceso) los derivados que falten de todo UPLOAD_DIR."""
+    if not image_store.enabled:
+        print("Pillow no está instalado")
+        return
+    built = failed = 0
+    for path in sorted(image_store.root.iterdir()):
+        if not path.is_file() or path.name.startswith(".") or image_store._has_files(path.name):
+            continue
+        try:
+            imaging.make_variants(str(path), str(image_store.vdir), path.name, image_store.sizes)
+            built += 1
+        except Exception as e:
+            failed += 1
+            print(f"{path.name}: {e!r}")
+    print({"built": built, "failed": failed})
+
+def _pipe_raw(stream, sink: UploadSink):
+    while True:
+        chunk = stream.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            return
+        sink.write(chunk)
+
+def _pipe_multipart(stream, boundary: bytes, sink: UploadSink, field: str = "file"):
+    """Recorre el multipart a medida que llega; sólo la parte `field` va al sink."""
+    # el decoder sólo retiene la cola de cada trozo (por si parte el boundary): cota holgada
+    decoder = MultipartDecoder(boundary, max_form_memory_size=4 * UPLOAD_CHUNK_BYTES)
+    in_file = found = False
+    while True:
+        chunk = stream.read(UPLOAD_CHUNK_BYTES)
+        decoder.receive_data(chunk or None)
+        event = decoder.next_event()
+        while not isinstance(event, (NeedData, Epilogue)):
+            if isinstance(event, File):
+                in_file = event.name == field and not found
+                found = found or in_file
+            elif isinstance(event, Field):
+                in_file = False
+            elif isinstance(event, Data) and in_file:
+                sink.write(event.data)
+            event = decoder.next_event()
+        if isinstance(event, Epilogue) or not chunk:
+            break
+    if not found:
+        raise UploadRejected(f"Falta la parte '{field}' en el multipart")
+
+def store_upload(stream, content_type: str | None) -> dict:
+    """Guarda el cuerpo de la petición (binario o multipart) en UPLOAD_DIR sin cargarlo entero."""
+    sink = UploadSink()
+    try:
+        mimetype, options = parse_options_header(content_type or "")
+        if mimetype == "multipart/form-data":
+            if not options.get("boundary"):
+                raise UploadRejected("multipart sin boundary")
+            _pipe_multipart(stream, options["boundary"].encode("latin-1"), sink)
+        else:
+            _pipe_raw(stream, sink)
+        stored = sink.finish()
+    except UploadRejected:
+        sink.abort()
+        raise
+    except ValueError:
+        sink.abort()
+        raise UploadRejected("multipart inválido")
+    image_store.schedule(stored["filename"])
+    return stored
+
+def store_upload_bytes(raw: bytes) -> dict:
+    """Misma validación y nombre que store_upload, para cuerpos que ya están en memoria."""
+    sink = UploadSink()
+    try:
+        sink.write(raw)
+        stored = sink.finish()
+    except UploadRejected:
+        sink.abort()
+        raise
+    image_store.schedule(stored["filename"])
+    return stored
+
+def upload_url(filename: str) -> str:
+    base = os.getenv("PUBLIC_BASE_URL", request.host_url.rstrip("/"))
+    return f"{base}/{UPLOAD_DIR}/{filename}".replace("//", "/").replace(":/", "://")
+
+@app.post("/upload/image/stream")
+@jwt_required()
+def upload_image_stream():
+    """
+    Cuerpo binario (Content-Type: image/* u application/octet-stream)
+    o multipart/form-data con la parte "file". Se escribe a disco por trozos.
+    Respuesta: { "url", "sha256", "size", "duplicate", "thumb_url", "medium_url" }
+    (los derivados son null hasta que el pool los genera; duplicate: ya estaba guardada)
+    """
+    if request.content_length is not None and request.content_length > UPLOAD_MAX_BYTES + UPLOAD_CHUNK_BYTES:
+        return jsonify({"msg": f"Imagen demasiado grande (máx {UPLOAD_MAX_BYTES} bytes)"}), 413
+    try:
+        stored = store_upload(request.stream, request.content_type)
+    except UploadRejected as e:
+        return jsonify({"msg": e.msg}), e.status
+    url = upload_url(stored["filename"])
+    return jsonify({"url": url, "sha256": stored["sha256"], "size": stored["size"],
+                    "duplicate": stored["duplicate"], **image_store.variants(url)}), 201
+
 @app.post("/upload/image")
 @jwt_required()
 def upload_image():
     """
     body: { "base64": "data:image/png;base64,AAAA..." }  o  { "b64": "AAAA..." }
+    Compatibilidad: para subidas nuevas usa /upload/image/stream (sin base64 ni JSON).
     """
     data = request.get_json(force=True) or {}
     b64 = data.get("base64") or data.get("b64")
@@ -1009,19 +2544,189 @@ def upload_image():
     # strip header
     if "," in b64:
         b64 = b64.split(",",1)[1]
-    raw = base64.b64decode(b64)
-    ts = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
-    fname = f"chat_{ts}.png"
-    (pathlib.Path(UPLOAD_DIR)/fname).write_bytes(raw)
-    base = os.getenv("PUBLIC_BASE_URL", request.host_url.rstrip("/"))
-    url = f"{base}/{UPLOAD_DIR}/{fname}".replace("//", "/").replace(":/", "://")
-    return jsonify({"url": url})
-def ensure_bot_user(db) -> User:
-    bot = db.query(User).filter_by(email="tink@bot").first()
+    try:
+        stored = store_upload_bytes(base64.b64decode(b64))
+    except binascii.Error:
+        return jsonify({"msg": "base64 inválido"}), 400
+    except UploadRejected as e:
+        return jsonify({"msg": e.msg}), e.status
+    return jsonify({"url": upload_url(stored["filename"])})
+
+# =========================
+# Media (servir subidas)
+# =========================
+MEDIA_URL_PATH = "/" + UPLOAD_DIR.strip("/")   # mismas URLs que ya guarda la DB (upload_url)
+MEDIA_ROOT = os.path.abspath(UPLOAD_DIR)       # send_file resolvería lo relativo contra app.root_path
+MEDIA_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+MEDIA_MAX_AGE = int(os.getenv("MEDIA_MAX_AGE", "86400"))  # nombres antiguos (chat_<ts>.png): revalidan por ETag
+# archivos por contenido y sus derivados: <sha256>.<ext>[.<variante>.webp]
+CONTENT_ADDRESSED_RE = re.compile(r"^(?:_v/)?([0-9a-f]{64})\.\w+((?:\.\w+)*)$")
+# variantes precomprimidas opcionales junto al archivo (<archivo>.br / <archivo>.gz)
+MEDIA_PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+# detrás de un proxy con X-Sendfile, el proxy envía el archivo y Flask sólo pone cabeceras
+app.config["USE_X_SENDFILE"] = os.getenv("MEDIA_X_SENDFILE", "0") == "1"
+
+@app.get(f"{MEDIA_URL_PATH}/<path:filename>")
+def serve_media(filename):
+    """
+    Archivos de UPLOAD_DIR con ETag/If-None-Match (304), Range (206) y envío sin copia
+    (wsgi.file_wrapper -> sendfile). Los nombres por contenido nunca cambian: immutable, 1 año.
+    """
+    path = safe_join(MEDIA_ROOT, filename)
+    if path is None or pathlib.PurePosixPath(filename).name.startswith(".") or not os.path.isfile(path):
+        abort(404)
+
+    m = CONTENT_ADDRESSED_RE.match(filename)
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    encoding = None
+    for enc, suffix in MEDIA_PRECOMPRESSED:
+        if request.accept_encodings[enc] and os.path.isfile(path + suffix):
+            path, encoding = path + suffix, enc
+            break
+
+    if m:
+        etag = f"{m.group(1)}{m.group(2)}" + (f"-{encoding}" if encoding else "")
+        resp = send_file(path, mimetype=mimetype, conditional=True, etag=etag, max_age=MEDIA_IMMUTABLE_MAX_AGE)
+        resp.cache_control.public = True
+        resp.cache_control.immutable = True
+    else:
+        resp = send_file(path, mimetype=mimetype, conditional=True, etag=True, max_age=MEDIA_MAX_AGE)
+        resp.cache_control.public = True
+    if encoding:
+        resp.headers["Content-Encoding"] = encoding
+    resp.vary.add("Accept-Encoding")
+    return resp
+
+_bot_user_id: int | None = None
+
+def ensure_bot_user(db) -> UserSnapshot:
+    """Usuario 'tink' (lo crea la primera vez); el id queda en memoria y el resto en user_cache."""
+    global _bot_user_id
+    bot = user_cache.get(_bot_user_id, db) if _bot_user_id else None
     if not bot:
-        bot = User(email="tink@bot", password=hash_pw("bot"), role="artist", name="tink")
-        db.add(bot); db.commit()
+        row = db.query(User).filter_by(email="tink@bot").first()
+        if not row:
+            row = User(email="tink@bot", password=hash_pw("bot"), role="artist", name="tink")
+            db.add(row); db.commit()
+        _bot_user_id = row.id
+        bot = user_cache.get(row.id, db)
     return bot
+# =========================
+# Cache de respuestas IA (DashScope)
+# =========================
+AI_CACHE_PATH = os.getenv("AI_CACHE_PATH", "ai_cache.db")
+AI_CACHE_MEMORY_ITEMS = int(os.getenv("AI_CACHE_MEMORY_ITEMS", "512"))
+# TTL en segundos por tipo de request (0 = sin cache). Las URLs de imagen de DashScope
+# caducan a las 24 h, por eso el TTL de imagen queda por debajo.
+AI_CACHE_TTL = {
+    "text": int(os.getenv("AI_CACHE_TEXT_TTL", "86400")),
+    "image": int(os.getenv("AI_CACHE_IMAGE_TTL", "72000")),
+}
+
+def normalize_prompt(prompt: str) -> str:
+    """Minúsculas, sin la mención @tink y con espacios colapsados."""
+    t = (prompt or "").casefold().replace("@tink", " ")
+    return " ".join(t.split())
+
+AI_CACHE_PURGE_SECONDS = int(os.getenv("AI_CACHE_PURGE_SECONDS", "3600"))
+
+class ResponseCache:
+    """
+    Dos niveles: LRU en memoria con TTL delante de un SQLite en disco (sobrevive reinicios
+    y se comparte entre procesos). La clave es un hash de (tipo, modelo, parámetros, prompt normalizado).
+    El candado sólo cubre el LRU y los contadores: el disco se lee y escribe fuera de él, con
+    una conexión por hilo. Las filas vencidas se borran al escribir, como mucho una vez por
+    AI_CACHE_PURGE_SECONDS.
+    """
+    def __init__(self, path: str, max_items: int):
+        self._path = path
+        self._max_items = max_items
+        self._lock = threading.Lock()
+        self._mem: OrderedDict[str, tuple[float, object]] = OrderedDict()
+        self._local = threading.local()
+        self._next_purge = 0.0
+        self.counters = {kind: {"memory_hits": 0, "disk_hits": 0, "misses": 0} for kind in AI_CACHE_TTL}
+
+    @staticmethod
+    def make_key(kind: str, model: str, params: dict, prompt: str) -> str:
+        raw = json.dumps([kind, model, params, normalize_prompt(prompt)], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _disk(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ai_cache ("
+                "key TEXT PRIMARY KEY, kind TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_ai_cache_expires ON ai_cache (expires_at)")
+            conn.commit()
+            self._local.conn = conn
+        return conn
+
+    def get(self, kind: str, key: str):
+        if not AI_CACHE_TTL.get(kind):
+            return None
+        now = time.time()
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit and hit[0] > now:
+                self._mem.move_to_end(key)
+                self.counters[kind]["memory_hits"] += 1
+                return hit[1]
+        try:
+            row = self._disk().execute(
+                "SELECT value, expires_at FROM ai_cache WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print("ai_cache read error:", e)
+            row = None
+        with self._lock:
+            if row and row[1] > now:
+                value = json.loads(row[0])
+                self._remember(key, row[1], value)
+                self.counters[kind]["disk_hits"] += 1
+                return value
+            self.counters[kind]["misses"] += 1
+            return None
+
+    def put(self, kind: str, key: str, value):
+        ttl = AI_CACHE_TTL.get(kind)
+        if not ttl:
+            return
+        now = time.time()
+        expires_at = now + ttl
+        with self._lock:
+            self._remember(key, expires_at, value)
+            purge = now >= self._next_purge
+            if purge:
+                self._next_purge = now + AI_CACHE_PURGE_SECONDS
+        try:
+            conn = self._disk()
+            conn.execute(
+                "INSERT OR REPLACE INTO ai_cache (key, kind, value, expires_at) VALUES (?, ?, ?, ?)",
+                (key, kind, json.dumps(value, ensure_ascii=False), expires_at),
+            )
+            if purge:
+                conn.execute("DELETE FROM ai_cache WHERE expires_at < ?", (now,))
+            conn.commit()
+        except sqlite3.Error as e:
+            print("ai_cache write error:", e)
+
+    def _remember(self, key, expires_at, value):
+        self._mem[key] = (expires_at, value)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self._max_items:
+            self._mem.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"memory_items": len(self._mem), **self.counters}
+
+ai_cache = ResponseCache(AI_CACHE_PATH, AI_CACHE_MEMORY_ITEMS)
+
 REGION = (os.getenv("DASHSCOPE_REGION") or "intl").lower()
 GEN_ENDPOINT = (
     "https://dashscope-intl.aliyuncs.com/api/v1/services/aigc/multimodal-generation/generation"
@@ -1046,26 +2751,35 @@ def _extract_image_urls_from_response(data: dict):
         for ch in out.get("choices", []):
             msg = ch.get("message") or {}
             for c in (msg.get("content") or []):
-                if "image" in c:
+                if isinstance(c, dict) and c.get("image"):
                     urls.append(c["image"])
     return urls
 
 def generate_image_via_qwen(prompt: str, *, size="1328*1328",
                             negative_prompt="", watermark=False, prompt_extend=True):
+    params = {
+        "size": size,
+        "negative_prompt": negative_prompt,
+        "watermark": bool(watermark),
+        "prompt_extend": bool(prompt_extend),
+    }
+    cache_key = ai_cache.make_key("image", "qwen-image-plus", params, prompt)
+    cached = ai_cache.get("image", cache_key)
+    if cached:
+        return cached
+
     body = {
         "model": "qwen-image-plus",
         "input": {"messages": [{"role": "user", "content": [{"text": prompt}]}]},
-        "parameters": {
-            "size": size,
-            "negative_prompt": negative_prompt,
-            "watermark": bool(watermark),
-            "prompt_extend": bool(prompt_extend),
-        },
+        "parameters": params,
     }
-    resp = requests.post(GEN_ENDPOINT, headers=_headers(), json=body, timeout=120)
+    resp = outbound.session("dashscope").post(GEN_ENDPOINT, headers=_headers(), json=body, timeout=120)
     data = resp.json()
     resp.raise_for_status()
-    return _extract_image_urls_from_response(data) or []
+    urls = _extract_image_urls_from_response(data) or []
+    if urls:
+        ai_cache.put("image", cache_key, urls)
+    return urls
 
 def looks_like_image_prompt(text: str) -> bool:
     t = (text or "").lower()
@@ -1085,8 +2799,13 @@ def qwen_reply(prompt: str) -> str:
         else "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation"
     )
 
+    cache_key = ai_cache.make_key("text", "qwen-plus", {}, prompt)
+    cached = ai_cache.get("text", cache_key)
+    if cached:
+        return cached
+
     try:
-        resp = requests.post(
+        resp = outbound.session("dashscope").post(
             endpoint,
             headers={"Authorization": f"Bearer {key}", "Content-Type": "application/json"},
             json={
@@ -1117,6 +2836,8 @@ def qwen_reply(prompt: str) -> str:
                             parts.append(c["text"])
                     txt = "\n".join([p for p in parts if p])
 
+        if txt:
+            ai_cache.put("text", cache_key, txt)
         return txt or "(tink) sin respuesta (formato inesperado)"
     except Exception as e:
         try:
@@ -1126,6 +2847,104 @@ def qwen_reply(prompt: str) -> str:
         print("qwen_reply error:", repr(e), detail)
         return "(@tink) Problemas con el asistente ahora mismo."
 
+# =========================
+# Bot @tink (cola de trabajos)
+# =========================
+BOT_MAX_WORKERS = int(os.getenv("BOT_MAX_WORKERS", "4"))    # llamadas a DashScope en paralelo
+BOT_QUEUE_MAX = int(os.getenv("BOT_QUEUE_MAX", "100"))      # trabajos pendientes (en cola + en curso)
+BOT_MAX_PER_USER = int(os.getenv("BOT_MAX_PER_USER", "2"))  # pendientes por usuario
+
+class BotJobQueue:
+    """
+    Pool acotado para las respuestas de @tink (texto 60 s / imagen 120 s de timeout),
+    así el POST del mensaje no espera a DashScope. submit() devuelve False si se
+    supera el límite global de pendientes o el límite por usuario.
+    """
+    def __init__(self, max_workers: int, max_pending: int, max_per_user: int):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tink")
+        self._max_pending = max_pending
+        self._max_per_user = max_per_user
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._per_user: dict[int, int] = {}
+
+    def submit(self, user_id: int, fn, *args) -> bool:
+        with self._lock:
+            if self._pending >= self._max_pending:
+                return False
+            if self._per_user.get(user_id, 0) >= self._max_per_user:
+                return False
+            self._pending += 1
+            self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+        self._pool.submit(self._run, user_id, fn, args)
+        return True
+
+    def _run(self, user_id, fn, args):
+        try:
+            fn(*args)
+        except Exception as e:
+            print("tink job error:", repr(e))
+        finally:
+            with self._lock:
+                self._pending -= 1
+                left = self._per_user.get(user_id, 1) - 1
+                if left > 0:
+                    self._per_user[user_id] = left
+                else:
+                    self._per_user.pop(user_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"pending": self._pending, "users": len(self._per_user)}
+
+bot_jobs = BotJobQueue(BOT_MAX_WORKERS, BOT_QUEUE_MAX, BOT_MAX_PER_USER)
+
+def tink_reply_text(text: str) -> str:
+    """Respuesta de @tink: imagen vía Qwen si parece pedido de imagen, si no texto."""
+    if looks_like_image_prompt(text):
+        # === Generación de imagen vía Qwen, igualando a chatbot.py ===
+        key = os.getenv("DASHSCOPE_API_KEY") or os.getenv("QWEN_API_KEY")
+        if not key:
+            return "(@tink) Falta DASHSCOPE_API_KEY en el .env para generar imágenes."
+        try:
+            urls = generate_image_via_qwen(text)
+            if urls:
+                return "(@tink) Imagen lista:\n" + "\n".join(urls)
+            return "(@tink) No recibí URL de imagen en la respuesta."
+        except Exception as e:
+            return f"(@tink) Falló la generación de imagen: {e}"
+    # Respuesta de texto con Qwen
+    try:
+        return qwen_reply(text)
+    except Exception:
+        return "(@tink) Problemas con el asistente ahora mismo."
+
+def post_bot_message(db, th: ChatThread, bot_id: int, text: str) -> ChatMessage:
+    """Inserta el mensaje del bot en el hilo y despierta a los streams."""
+    bot_msg = ChatMessage(
+        thread_id=th.id,
+        sender_id=bot_id,
+        text=text,
+        created_at=datetime.now(timezone.utc)
+    )
+    db.add(bot_msg)
+    db.flush()
+    apply_message_to_thread(th, bot_msg)
+    db.commit()
+    broker.publish(chat_channel(th.id))
+    return bot_msg
+
+def run_tink_job(thread_id: int, bot_id: int, text: str):
+    """Trabajo en segundo plano: llama a DashScope sin sesión abierta y luego inserta."""
+    bot_text = tink_reply_text(text)
+    db = SessionLocal.session_factory()
+    try:
+        th = db.get(ChatThread, thread_id)
+        if th:
+            post_bot_message(db, th, bot_id, bot_text)
+    finally:
+        db.close()
+
 # =========================
 # Auth
 # =========================
@@ -1148,6 +2967,8 @@ def register():
             return jsonify({"msg": "Email ya registrado"}), 409
         user = User(email=email, password=hash_pw(password), role=role, name=name)
         db.add(user)
+        db.flush()
+        refresh_artist_directory(db, user)
         db.commit()
         return jsonify({"msg": "Registrado", "user_id": user.id}), 201
     finally:
@@ -1175,77 +2996,522 @@ def login():
 @jwt_required(refresh=True)
 def refresh_token():
     ident = get_jwt_identity()
-    new_access = create_access_token(identity=ident)
+    user = user_cache.get(int(ident))
+    if not user:
+        return jsonify({"msg": "No autorizado"}), 401
+    new_access = create_access_token(identity=ident, additional_claims={"role": user.role})
     return jsonify({"access_token": new_access})
 
+# =========================
+# Búsqueda full-text de diseños
+# =========================
+# SQLite: tabla FTS5 designs_fts (rowid = designs.id) con unicode61 sin diacríticos,
+# sincronizada por create/update/delete_design en la misma transacción; ranking BM25.
+# Postgres: índice GIN sobre to_tsvector con una configuración 'spanish' + unaccent;
+# se mantiene solo. Otros motores: ILIKE como antes.
+DESIGNS_SEARCH_MAX = int(os.getenv("DESIGNS_SEARCH_MAX", "500"))  # resultados rankeados por búsqueda
+PG_TS_CONFIG = "es_unaccent"
+PG_DESIGN_TSV = (
+    f"to_tsvector('{PG_TS_CONFIG}'::regconfig, coalesce(title, '') || ' ' || coalesce(description, ''))"
+)
+_design_search = {"backend": None, "ready": False}  # backend: 'fts5' | 'postgres' | None
+_design_search_lock = threading.Lock()
+
+def design_search_backend() -> str | None:
+    """Backend full-text activo; lo detecta (y crea el índice) la primera vez."""
+    if not _design_search["ready"]:
+        with _design_search_lock:
+            if not _design_search["ready"]:
+                ensure_design_search_index()
+    return _design_search["backend"]
+
+def search_terms(qtext: str) -> list[str]:
+    """Palabras de la búsqueda (sin operadores ni comillas del usuario)."""
+    return re.findall(r"\w+", qtext or "")
+
+def ensure_design_search_index():
+    """Crea el índice full-text si falta y lo reconstruye si está desfasado."""
+    dialect = engine.dialect.name
+    backend = None
+    try:
+        if dialect == "sqlite":
+            with engine.begin() as conn:
+                conn.execute(sql_text(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS designs_fts USING fts5("
+                    "title, description, tokenize = 'unicode61 remove_diacritics 2')"
+                ))
+                indexed = conn.execute(sql_text("SELECT count(*) FROM designs_fts")).scalar()
+                total = conn.execute(sql_text("SELECT count(*) FROM designs")).scalar()
+            backend = "fts5"
+            if indexed != total:
+                _rebuild_fts(engine)
+        elif dialect == "postgresql":
+            with engine.begin() as conn:
+                conn.execute(sql_text("CREATE EXTENSION IF NOT EXISTS unaccent"))
+                exists = conn.execute(
+                    sql_text("SELECT 1 FROM pg_ts_config WHERE cfgname = :n"), {"n": PG_TS_CONFIG}
+                ).scalar()
+                if not exists:
+                    conn.execute(sql_text(f"CREATE TEXT SEARCH CONFIGURATION {PG_TS_CONFIG} (COPY = spanish)"))
+                    conn.execute(sql_text(
+                        f"ALTER TEXT SEARCH CONFIGURATION {PG_TS_CONFIG} "
+                        "ALTER MAPPING FOR hword, hword_part, word WITH unaccent, spanish_stem"
+                    ))
+                conn.execute(sql_text(
+                    f"CREATE INDEX IF NOT EXISTS ix_designs_fts ON designs USING gin ({PG_DESIGN_TSV})"
+                ))
+            backend = "postgres"
+    except Exception as e:
+        print("Búsqueda full-text no disponible, se usa ILIKE:", e)
+        backend = None
+    _design_search.update(backend=backend, ready=True)
+
+def rebuild_design_search_index():
+    if design_search_backend() == "fts5":
+        _rebuild_fts(engine)
+
+def _rebuild_fts(conn_engine):
+    with conn_engine.begin() as conn:
+        conn.execute(sql_text("DELETE FROM designs_fts"))
+        conn.execute(sql_text(
+            "INSERT INTO designs_fts (rowid, title, description) "
+            "SELECT id, title, coalesce(description, '') FROM designs"
+        ))
+
+@app.cli.command("rebuild-search-index")
+def rebuild_search_index_command():
+    """Reconstruye el índice full-text de diseños."""
+    rebuild_design_search_index()
+    print("ok", design_search_backend())
+
+def index_design(db, d: Design):
+    """Sincroniza el diseño en el índice (antes del commit; requiere d.id)."""
+    if design_search_backend() != "fts5":
+        return
+    db.execute(sql_text("DELETE FROM designs_fts WHERE rowid = :id"), {"id": d.id})
+    db.execute(
+        sql_text("INSERT INTO designs_fts (rowid, title, description) VALUES (:id, :t, :d)"),
+        {"id": d.id, "t": d.title or "", "d": d.description or ""},
+    )
+
+def unindex_design(db, design_id: int):
+    if design_search_backend() != "fts5":
+        return
+    db.execute(sql_text("DELETE FROM designs_fts WHERE rowid = :id"), {"id": design_id})
+
+def search_design_ids(db, qtext: str) -> list[int] | None:
+    """
+    Ids de diseños que calzan con qtext, ordenados por relevancia (BM25 / ts_rank_cd),
+    con prefijo por palabra e insensible a tildes. None si no hay backend full-text.
+    """
+    backend = design_search_backend()
+    if backend is None:
+        return None
+    terms = search_terms(qtext)
+    if not terms:
+        return []
+    if backend == "fts5":
+        match = " ".join(f'"{t}"*' for t in terms)
+        rows = db.execute(sql_text(
+            "SELECT rowid FROM designs_fts WHERE designs_fts MATCH :q "
+            "ORDER BY bm25(designs_fts, 2.0, 1.0) LIMIT :n"
+        ), {"q": match, "n": DESIGNS_SEARCH_MAX}).all()
+    else:
+        tsq = " & ".join(f"{t}:*" for t in terms)
+        rows = db.execute(sql_text(
+            f"SELECT id FROM designs WHERE {PG_DESIGN_TSV} @@ to_tsquery('{PG_TS_CONFIG}', :q) "
+            f"ORDER BY ts_rank_cd({PG_DESIGN_TSV}, to_tsquery('{PG_TS_CONFIG}', :q)) DESC, id DESC LIMIT :n"
+        ), {"q": tsq, "n": DESIGNS_SEARCH_MAX}).all()
+    return [r[0] for r in rows]
+
+# =========================
+# Directorio de artistas ('@nombre')
+# =========================
+ARTIST_SEARCH_LIMIT = 20
+
+def normalize_search_key(s: str) -> str:
+    """Minúsculas y sin diacríticos ('José' -> 'jose')."""
+    decomposed = unicodedata.normalize("NFKD", s or "")
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold()
+
+def artist_terms(user: User) -> set[str]:
+    email = normalize_search_key(user.email)
+    terms = {normalize_search_key(w) for w in search_terms(user.name)}
+    terms |= {normalize_search_key(w) for w in search_terms(email.split("@")[0])}
+    terms.add(email)
+    return {t[:255] for t in terms if t}
+
+def refresh_artist_directory(db, user: User):
+    """Reindexa un usuario (llamar tras registrar o cambiar nombre/email/rol; antes del commit)."""
+    db.query(ArtistSearchTerm).filter(ArtistSearchTerm.user_id == user.id).delete(synchronize_session=False)
+    if user.role == "artist" and user.email != "tink@bot":
+        db.add_all([ArtistSearchTerm(term=t, user_id=user.id) for t in artist_terms(user)])
+
+def rebuild_artist_directory(db):
+    db.query(ArtistSearchTerm).delete(synchronize_session=False)
+    for user in db.query(User).filter(User.role == "artist").all():
+        refresh_artist_directory(db, user)
+    db.commit()
+
+@app.cli.command("rebuild-artist-directory")
+def rebuild_artist_directory_command():
+    """Reconstruye el directorio de artistas para la búsqueda '@'."""
+    db = SessionLocal.session_factory()
+    try:
+        rebuild_artist_directory(db)
+        print("ok")
+    finally:
+        db.close()
+
+def artist_match_conditions(qtext: str) -> list:
+    """
+    Una condición por palabra: el artista debe tener algún término con ese prefijo.
+    En SQLite (collation binaria) es un rango (term >= w AND term < w+U+FFFF) servido por
+    la PK del directorio; en otros motores el rango depende de la collation, así que se usa
+    LIKE 'w%' (índice text_pattern_ops en Postgres).
+    """
+    binary = engine.dialect.name == "sqlite"
+    conds = []
+    for w in search_terms(normalize_search_key(qtext)):
+        if binary:
+            prefix = and_(ArtistSearchTerm.term >= w, ArtistSearchTerm.term < w + "\uffff")
+        else:
+            prefix = ArtistSearchTerm.term.startswith(w, autoescape=True)
+        ids = select(ArtistSearchTerm.user_id).where(prefix)
+        conds.append(User.id.in_(ids))
+    return conds
+
+# =========================
+# Estadísticas de artista (en memoria)
+# =========================
+ARTIST_STATS_TTL = float(os.getenv("ARTIST_STATS_TTL", "300"))  # cota de desfase entre procesos
+ARTIST_STATS_BULK_MAX = 100
+ACTIVE_APPT_STATUSES = ("booked", "confirmed")
+COMPLETED_APPT_STATUSES = ("confirmed", "done")
+
+class ArtistStatsStore:
+    """
+    designs_count / likes_total / upcoming_bookings / completed_sessions por artista, en memoria.
+    - Diseños y likes se ajustan por delta (bump) cuando cambian.
+    - Las citas invalidan la entrada del artista; además cada entrada vence sola en su
+      próximo "borde" temporal (inicio de la próxima cita o fin de una confirmada), porque
+      upcoming/completed cambian con el reloj sin que haya escrituras.
+    Cada cambio incrementa la versión del artista (stats_version) para que el cliente compare.
+    """
+    def __init__(self, ttl: float):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: dict[int, dict] = {}
+        self._versions: dict[int, int] = {}
+
+    def get_many(self, artist_ids: list[int]) -> dict[int, dict]:
+        """Stats de los artistas existentes entre artist_ids (una carga agrupada para los que falten)."""
+        now, mono = datetime.utcnow(), time.monotonic()
+        out = {}
+        with self._lock:
+            for aid in artist_ids:
+                e = self._entries.get(aid)
+                if e and e["loaded_at"] + self._ttl > mono and (e["boundary"] is None or e["boundary"] > now):
+                    out[aid] = dict(e["stats"], stats_version=self._versions.get(aid, 0))
+        missing = [aid for aid in artist_ids if aid not in out]
+        if missing:
+            with self._lock:
+                versions = {aid: self._versions.get(aid, 0) for aid in missing}
+            loaded = self._load(missing, now)
+            with self._lock:
+                for aid, (stats, boundary) in loaded.items():
+                    # un bump/invalidate durante la carga deja esta foto vieja: se responde
+                    # con la versión leída antes y no se guarda
+                    if self._versions.get(aid, 0) == versions[aid]:
+                        self._entries[aid] = {"stats": stats, "boundary": boundary, "loaded_at": mono}
+                    out[aid] = dict(stats, stats_version=versions[aid])
+        return out
+
+    def get(self, artist_id: int) -> dict | None:
+        return self.get_many([artist_id]).get(artist_id)
+
+    def bump(self, artist_id: int, **deltas):
+        with self._lock:
+            self._versions[artist_id] = self._versions.get(artist_id, 0) + 1
+            e = self._entries.get(artist_id)
+            if e:
+                for k, v in deltas.items():
+                    e["stats"][k] = e["stats"].get(k, 0) + v
+
+    def invalidate(self, artist_id: int):
+        with self._lock:
+            self._versions[artist_id] = self._versions.get(artist_id, 0) + 1
+            self._entries.pop(artist_id, None)
+
+    def _load(self, artist_ids: list[int], now: datetime) -> dict[int, tuple[dict, datetime | None]]:
+        db = SessionLocal.session_factory()
+        try:
+            likes = dict(
+                db.query(User.id, User.likes_total)
+                  .filter(User.id.in_(artist_ids), User.role == "artist").all()
+            )
+            ids = list(likes)
+            if not ids:
+                return {}
+            designs = dict(
+                db.query(Design.artist_id, func.count(Design.id))
+                  .filter(Design.artist_id.in_(ids)).group_by(Design.artist_id).all()
+            )
+            upcoming = and_(Appointment.status.in_(ACTIVE_APPT_STATUSES), Appointment.start_time >= now)
+            completed = and_(Appointment.status.in_(COMPLETED_APPT_STATUSES), Appointment.end_time < now)
+            finishing = and_(Appointment.status.in_(COMPLETED_APPT_STATUSES), Appointment.end_time >= now)
+            appts = {
+                aid: (up or 0, done or 0, next_start, next_end)
+                for aid, up, done, next_start, next_end in (
+                    db.query(
+                        Appointment.artist_id,
+                        func.sum(case((upcoming, 1), else_=0)),
+                        func.sum(case((completed, 1), else_=0)),
+                        func.min(case((upcoming, Appointment.start_time), else_=None)),
+                        func.min(case((finishing, Appointment.end_time), else_=None)),
+                    )
+                    .filter(Appointment.artist_id.in_(ids))
+                    .group_by(Appointment.artist_id).all()
+                )
+            }
+            out = {}
+            for aid in ids:
+                up, done, next_start, next_end = appts.get(aid, (0, 0, None, None))
+                bounds = [parse_db_dt(b) for b in (next_start, next_end) if b is not None]
+                out[aid] = ({
+                    "designs_count": int(designs.get(aid, 0)),
+                    "likes_total": int(likes.get(aid) or 0),
+                    "upcoming_bookings": int(up),
+                    "completed_sessions": int(done),
+                }, min(bounds) if bounds else None)
+            return out
+        finally:
+            db.close()
+
+artist_stats = ArtistStatsStore(ARTIST_STATS_TTL)
+
+# =========================
+# Cache HTTP (ETag / 304)
+# =========================
+HTTP_CACHE_TTL = float(os.getenv("HTTP_CACHE_TTL", "30"))  # cota de desfase entre procesos
+HTTP_CACHE_MAX_ENTRIES = int(os.getenv("HTTP_CACHE_MAX_ENTRIES", "2048"))
+
+class HttpCache:
+    """
+    Respuestas GET ya serializadas, por (endpoint, URL, usuario), con un contador de versión
+    por recurso ("designs", ("favorites", uid), ("artist", id), ("appointment", id), "media").
+    Las escrituras hacen bump() de lo que tocan; una entrada sólo sirve si las versiones de sus
+    recursos no cambiaron desde que se armó. Así If-None-Match -> 304 (o el cuerpo cacheado)
+    sale sin tocar la DB. El ETag es un hash del cuerpo: igual en todos los procesos.
+    Los contadores son por proceso: entre workers el desfase queda acotado por HTTP_CACHE_TTL.
+    """
+    def __init__(self, ttl: float, max_entries: int):
+        self._ttl = ttl
+        self._max = max_entries
+        self._lock = threading.Lock()
+        self._versions: dict = {}
+        self._entries: OrderedDict = OrderedDict()
+        self._hits = self._not_modified = self._misses = 0
+
+    def bump(self, *resources):
+        with self._lock:
+            for r in resources:
+                self._versions[r] = self._versions.get(r, 0) + 1
+
+    def versions(self, deps) -> tuple:
+        """Versiones actuales de deps; tomarlas ANTES de armar la respuesta que se pasa a store()."""
+        with self._lock:
+            return self._versions_of(deps)
+
+    def _versions_of(self, deps) -> tuple:
+        return tuple(self._versions.get(r, 0) for r in deps)
+
+    def lookup(self, key, deps):
+        now = time.monotonic()
+        with self._lock:
+            e = self._entries.get(key)
+            if e and e["expires"] > now and e["versions"] == self._versions_of(deps):
+                self._entries.move_to_end(key)
+                return e
+            return None
+
+    def store(self, key, versions: tuple, resp: Response) -> dict:
+        body = resp.get_data()
+        e = {
+            "versions": versions,
+            "expires": time.monotonic() + self._ttl,
+            "etag": hashlib.sha1(body).hexdigest(),
+            "body": body,
+            "headers": [(k, v) for k, v in resp.headers.items() if k in ("Content-Type", "X-Next-Cursor")],
+        }
+        with self._lock:
+            self._entries[key] = e
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max:
+                self._entries.popitem(last=False)
+        return e
+
+    def count(self, outcome: str):
+        with self._lock:
+            if outcome == "hit":
+                self._hits += 1
+            elif outcome == "not_modified":
+                self._not_modified += 1
+            else:
+                self._misses += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self._hits,
+                    "not_modified": self._not_modified, "misses": self._misses}
+
+http_cache = HttpCache(HTTP_CACHE_TTL, HTTP_CACHE_MAX_ENTRIES)
+
+def optional_identity() -> int | None:
+    """uid del JWT si viene uno válido (sin ir a la DB); None si es anónimo."""
+    try:
+        verify_jwt_in_request(optional=True)
+        ident = get_jwt_identity()
+        return int(ident) if ident else None
+    except Exception:
+        return None
+
+def http_cached(deps, per_user: bool = False):
+    """
+    Cachea las respuestas 200 del endpoint GET. deps(kwargs, uid) -> recursos de los que depende.
+    per_user: la variante autenticada se guarda aparte de la anónima (p. ej. is_favorited).
+    """
+    def wrapper(fn):
+        @wraps(fn)
+        def inner(*args, **kwargs):
+            uid = optional_identity() if per_user else None
+            resources = tuple(deps(kwargs, uid))
+            key = (fn.__name__, request.full_path, uid)
+            e = http_cache.lookup(key, resources)
+            if e is None:
+                versions = http_cache.versions(resources)  # antes de leer: una escritura en medio invalida
+                resp = app.make_response(fn(*args, **kwargs))
+                if resp.status_code != 200 or resp.is_streamed:
+                    return resp
+                if reads_from_replica() and replica_router.lagging():
+                    return resp  # leído de la réplica antes de que le llegara la última escritura
+                e = http_cache.store(key, versions, resp)
+                outcome = "miss"
+            else:
+                outcome = "hit"
+            if request.if_none_match.contains(e["etag"]):
+                http_cache.count("not_modified")
+                resp = Response(status=304)
+            else:
+                http_cache.count(outcome)
+                resp = Response(e["body"], status=200, headers=e["headers"])
+            resp.set_etag(e["etag"])
+            resp.cache_control.no_cache = True  # siempre revalida: 304 es barato
+            if per_user:
+                resp.cache_control.private = True
+                resp.vary.add("Authorization")
+            return resp
+        return inner
+    return wrapper
+
 # =========================
 # Designs (Catálogo)
 # =========================
+DESIGNS_PAGE_SIZE = int(os.getenv("DESIGNS_PAGE_SIZE", "30"))
+DESIGNS_PAGE_MAX = int(os.getenv("DESIGNS_PAGE_MAX", "100"))
+
+DESIGN_JSON = RowSerializer(
+    "id", "title", "description", "image_url",
+    ("*", lambda d: image_store.variants(d.image_url)),
+    "price", "artist_id",
+    ("likes_count", lambda d: int(d.likes_count or 0)),
+    "created_at",
+)
+FAVORITE_DESIGN_JSON = RowSerializer(("design_id", "id"), *DESIGN_JSON.without("id", "created_at").fields)
+
 @app.get("/designs")
+@http_cached(lambda kw, uid: ["designs", "media"] + ([("favorites", uid)] if uid else []), per_user=True)
 def list_designs():
+    """
+    Query: ?q=&artist_id=&limit=<int>&cursor=<X-Next-Cursor de la página anterior>
+    Paginación keyset sobre (created_at, id) desc; tamaño máximo impuesto por el servidor.
+    """
     qtext = (request.args.get("q") or "").strip()
     artist_id = request.args.get("artist_id", type=int)
+    limit = request.args.get("limit", default=DESIGNS_PAGE_SIZE, type=int)
+    limit = max(1, min(limit or DESIGNS_PAGE_SIZE, DESIGNS_PAGE_MAX))
+    # búsqueda por texto: orden por relevancia, el cursor lleva el offset dentro del ranking
+    text_search = bool(qtext) and not artist_id and not qtext.startswith('@')
+    try:
+        cursor = decode_cursor(request.args.get("cursor"))
+        if cursor and text_search:
+            offset = cursor[1] if cursor[0] == "rank" else 0
+            # el offset va directo a la rebanada del ranking: sólo enteros >= 0
+            if type(offset) is not int or offset < 0:
+                raise ValueError("cursor inválido")
+        elif cursor:
+            cursor = (parse_dt(cursor[0]), int(cursor[1]))
+    except (ValueError, TypeError, IndexError):
+        return jsonify({"msg": "cursor inválido"}), 400
 
     db = get_db()
     try:
         # usuario opcional para marcar favoritos
         uid = None
         try:
-            from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
             verify_jwt_in_request()  # fallará si no hay header -> except
             uid = int(get_jwt_identity())
         except Exception:
             pass
 
-        q = db.query(Design)
-        if artist_id:
-            q = q.filter(Design.artist_id == artist_id)
-        elif qtext:
-            if qtext.startswith('@'):
-                term = f"%{qtext[1:].strip()}%"
-                from sqlalchemy import or_
-                q = (
-                    q.join(User, User.id == Design.artist_id)
-                     .filter(or_(User.name.ilike(term), User.email.ilike(term)))
-                )
-            else:
-                term = f"%{qtext}%"
-                from sqlalchemy import or_
-                q = q.filter(or_(Design.title.ilike(term),
-                                 Design.description.ilike(term)))
-        designs = q.order_by(Design.created_at.desc()).all()
-
-        # Precalcular likes y si el user ya likeó
-        ids = [d.id for d in designs]
-        likes_map = {}
-        if ids:
-            rows = (
-                db.query(Favorite.design_id, func.count(Favorite.id))
-                  .filter(Favorite.design_id.in_(ids))
-                  .group_by(Favorite.design_id).all()
-            )
-            likes_map = {did: cnt for (did, cnt) in rows}
-
+        # nombre del artista en la misma consulta (sin lazy-load por fila)
+        q = db.query(Design, User.name).join(User, User.id == Design.artist_id)
+        ranked = search_design_ids(db, qtext) if text_search else None
+        next_cursor = None
+        if ranked is not None:
+            offset = offset if cursor else 0
+            page_ids = ranked[offset:offset + limit]
+            by_id = {d.id: (d, name) for d, name in q.filter(Design.id.in_(page_ids)).all()} if page_ids else {}
+            page = [by_id[i] for i in page_ids if i in by_id]
+            if offset + limit < len(ranked):
+                next_cursor = encode_cursor("rank", offset + limit)
+        else:
+            if artist_id:
+                q = q.filter(Design.artist_id == artist_id)
+            elif qtext:
+                if qtext.startswith('@'):
+                    # '@' solo: sin filtro, como antes
+                    q = q.filter(*artist_match_conditions(qtext[1:]))
+                else:
+                    term = f"%{qtext}%"
+                    q = q.filter(or_(Design.title.ilike(term),
+                                     Design.description.ilike(term)))
+            if cursor:
+                q = q.filter(or_(
+                    Design.created_at < cursor[0],
+                    and_(Design.created_at == cursor[0], Design.id < cursor[1]),
+                ))
+            page = q.order_by(Design.created_at.desc(), Design.id.desc()).limit(limit + 1).all()
+            if len(page) > limit:
+                page = page[:limit]
+                last = page[-1][0]
+                next_cursor = encode_cursor(last.created_at, last.id)
+
+        # likes_count viene en la fila; sólo falta saber si el user ya likeó
+        ids = [d.id for d, _ in page]
         fav_set = set()
         if uid and ids:
             mine = db.query(Favorite.design_id)\
                      .filter(Favorite.user_id == uid, Favorite.design_id.in_(ids)).all()
             fav_set = {did for (did,) in mine}
 
-        return jsonify([
-            {
-                "id": d.id,
-                "title": d.title,
-                "description": d.description,
-                "image_url": d.image_url,
-                "price": d.price,
-                "artist_id": d.artist_id,
-                "artist_name": d.artist.name if d.artist else None,
-                "likes_count": int(likes_map.get(d.id, 0)),
-                "is_favorited": bool(d.id in fav_set),
-                "created_at": d.created_at.isoformat(),
-            } for d in designs
+        resp = jsonify([
+            DESIGN_JSON(d, artist_name=artist_name, is_favorited=d.id in fav_set)
+            for d, artist_name in page
         ])
+        if next_cursor:
+            resp.headers["X-Next-Cursor"] = next_cursor
+        return resp
     finally:
         db.close()
 
@@ -1267,7 +3533,11 @@ def create_design():
             artist_id=request.current_user.id
         )
         db.add(d)
+        db.flush()
+        index_design(db, d)
         db.commit()
+        artist_stats.bump(d.artist_id, designs_count=1)
+        http_cache.bump("designs", ("artist", d.artist_id))
         return jsonify({"msg": "creado", "id": d.id}), 201
     finally:
         db.close()
@@ -1284,7 +3554,10 @@ def update_design(design_id):
         for field in ("title", "description", "image_url", "price"):
             if field in data:
                 setattr(d, field, data[field])
+        if "title" in data or "description" in data:
+            index_design(db, d)
         db.commit()
+        http_cache.bump("designs")
         return jsonify({"msg": "actualizado"})
     finally:
         db.close()
@@ -1297,8 +3570,14 @@ def delete_design(design_id):
         d = db.get(Design, design_id)
         if not d or d.artist_id != request.current_user.id:
             return jsonify({"msg": "No encontrado o sin permiso"}), 404
+        artist_id, likes = d.artist_id, d.likes_count or 0
+        if likes:
+            bump_like_counters(db, d.id, artist_id, -likes)
         db.delete(d)
+        unindex_design(db, design_id)
         db.commit()
+        artist_stats.bump(artist_id, designs_count=-1, likes_total=-likes)
+        http_cache.bump("designs", ("artist", artist_id))
         return jsonify({"msg": "eliminado"})
     finally:
         db.close()
@@ -1308,11 +3587,20 @@ def add_favorite(design_id):
     db = get_db()
     try:
         uid = int(get_jwt_identity())
-        if not db.get(Design, design_id):
+        d = db.get(Design, design_id)
+        if not d:
             return jsonify({"msg":"Diseño no encontrado"}), 404
         if not db.query(Favorite).filter_by(user_id=uid, design_id=design_id).first():
             db.add(Favorite(user_id=uid, design_id=design_id))
+            try:
+                db.flush()  # uq_fav: un doble tap concurrente no cuenta dos veces
+            except IntegrityError:
+                db.rollback()
+                return jsonify({"msg":"ok"})
+            bump_like_counters(db, d.id, d.artist_id, +1)
             db.commit()
+            artist_stats.bump(d.artist_id, likes_total=1)
+            http_cache.bump("designs", ("favorites", uid), ("artist", d.artist_id))
         return jsonify({"msg":"ok"})
     finally:
         db.close()
@@ -1323,9 +3611,16 @@ def remove_favorite(design_id):
     db = get_db()
     try:
         uid = int(get_jwt_identity())
-        f = db.query(Favorite).filter_by(user_id=uid, design_id=design_id).first()
-        if f:
-            db.delete(f); db.commit()
+        removed = db.query(Favorite).filter_by(user_id=uid, design_id=design_id).delete(synchronize_session=False)
+        if removed:
+            d = db.get(Design, design_id)
+            if d:
+                bump_like_counters(db, d.id, d.artist_id, -removed)
+            db.commit()
+            http_cache.bump("designs", ("favorites", uid))
+            if d:
+                artist_stats.bump(d.artist_id, likes_total=-removed)
+                http_cache.bump(("artist", d.artist_id))
         return jsonify({"msg":"ok"})
     finally:
         db.close()
@@ -1333,52 +3628,71 @@ def remove_favorite(design_id):
 @app.get("/favorites/me")
 @jwt_required()
 def favorites_me():
+    """Favoritos del usuario, más recientes primero; sin límite, así que se emite en streaming."""
+    uid = int(get_jwt_identity())
+    db = stream_session()  # vive hasta que termina el stream
+    rows = (
+        db.query(Favorite.created_at, Design, User.name)
+          .join(Design, Design.id == Favorite.design_id)
+          .join(User, User.id == Design.artist_id)
+          .filter(Favorite.user_id == uid)
+          .order_by(Favorite.created_at.desc())
+          .yield_per(JSON_STREAM_BATCH)
+    )
+    resp = json_stream(rows, lambda row: FAVORITE_DESIGN_JSON(row[1], artist_name=row[2], fav_at=row[0]))
+    resp.call_on_close(db.close)
+    return resp
+
+@app.get("/artists/search")
+def search_artists():
+    """
+    Autocompletado de artistas: ?q=<prefijo>&limit=<int default=10, máx 20>
+    Acepta '@al' o 'al'. Devuelve [{id, name}] ordenado por nombre.
+    """
+    qtext = (request.args.get("q") or "").strip().lstrip("@")
+    limit = max(1, min(request.args.get("limit", default=10, type=int) or 10, ARTIST_SEARCH_LIMIT))
+    conds = artist_match_conditions(qtext)
+    if not conds:
+        return jsonify([])
     db = get_db()
     try:
-        uid = int(get_jwt_identity())
         rows = (
-            db.query(Favorite, Design, User)
-              .join(Design, Design.id == Favorite.design_id)
-              .join(User, User.id == Design.artist_id)
-              .filter(Favorite.user_id == uid)
-              .order_by(Favorite.created_at.desc())
+            db.query(User.id, User.name)
+              .filter(User.role == "artist", *conds)
+              .order_by(User.name.asc(), User.id.asc())
+              .limit(limit)
               .all()
         )
-        out = []
-        for fav, d, artist in rows:
-            # conteo likes
-            cnt = db.query(Favorite).filter(Favorite.design_id==d.id).count()
-            out.append({
-                "design_id": d.id,
-                "title": d.title,
-                "description": d.description,
-                "image_url": d.image_url,
-                "price": d.price,
-                "artist_id": d.artist_id,
-                "artist_name": artist.name if artist else None,
-                "likes_count": cnt,
-                "fav_at": fav.created_at.isoformat(),
-            })
-        return jsonify(out)
+        return jsonify([{"id": uid, "name": name} for uid, name in rows])
     finally:
         db.close()
+
+@app.get("/artists/stats")
+def artists_stats_bulk():
+    """
+    Stats de varios artistas en una llamada: ?ids=1,2,3 (máx 100)
+    Devuelve [{artist_id, designs_count, likes_total, upcoming_bookings, completed_sessions, stats_version}].
+    """
+    try:
+        ids = [int(x) for x in (request.args.get("ids") or "").split(",") if x.strip()]
+    except ValueError:
+        return jsonify({"msg": "ids debe ser una lista de enteros separados por coma"}), 400
+    ids = list(dict.fromkeys(ids))[:ARTIST_STATS_BULK_MAX]
+    stats = artist_stats.get_many(ids)
+    return jsonify([{"artist_id": aid, **stats[aid]} for aid in ids if aid in stats])
+
 @app.get("/artists/<int:artist_id>")
+@http_cached(lambda kw, uid: [("artist", kw["artist_id"])])
 def get_artist(artist_id):
     db = get_db()
     try:
-        a = db.get(User, artist_id)
+        a = user_cache.get(artist_id, db)
         if not a or a.role != "artist":
             return jsonify({"msg":"Artista no encontrado"}), 404
-        designs_count = db.query(Design).filter(Design.artist_id==a.id).count()
-        likes_total = (
-            db.query(func.count(Favorite.id))
-              .join(Design, Design.id == Favorite.design_id)
-              .filter(Design.artist_id == a.id).scalar()
-        ) or 0
+        stats = artist_stats.get(a.id) or {}
         return jsonify({
             "id": a.id, "name": a.name, "email": a.email,
-            "designs_count": int(designs_count),
-            "likes_total": int(likes_total),
+            **stats,
         })
     finally:
         db.close()
@@ -1387,6 +3701,239 @@ def get_artist(artist_id):
 # Appointments (Agenda)
 # =========================
 DEFAULT_APPT_MINUTES = 60  # puedes exponerlo como config
+AVAILABILITY_TTL = float(os.getenv("AVAILABILITY_TTL", "60"))               # cota de desfase entre procesos
+AVAILABILITY_LOAD_DAYS = int(os.getenv("AVAILABILITY_LOAD_DAYS", "42"))     # una vista de mes completa (6 semanas)
+AVAILABILITY_MAX_DAYS = int(os.getenv("AVAILABILITY_MAX_DAYS", "62"))
+AVAILABILITY_MAX_MINUTES = 12 * 60
+
+class BusyIntervals:
+    """
+    Tramos ocupados de un artista dentro de [lo, hi), ordenados y fusionados.
+    Al no solaparse, starts y ends quedan ambos ordenados y se recorren con bisect.
+    """
+    def __init__(self, lo: datetime, hi: datetime, intervals):
+        self.lo, self.hi = lo, hi
+        self.starts: list[datetime] = []
+        self.ends: list[datetime] = []
+        for s, e in sorted(intervals):
+            if self.ends and s <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], e)
+            else:
+                self.starts.append(s)
+                self.ends.append(e)
+
+    def covers(self, lo: datetime, hi: datetime) -> bool:
+        return self.lo <= lo and hi <= self.hi
+
+    def overlaps(self, start: datetime, end: datetime) -> bool:
+        i = bisect_right(self.ends, start)
+        return i < len(self.starts) and self.starts[i] < end
+
+    def free_slots(self, lo: datetime, hi: datetime, duration: timedelta) -> list[tuple[datetime, datetime]]:
+        """Huecos libres dentro de [lo, hi) de al menos `duration`."""
+        out = []
+        cursor = lo
+        i = bisect_right(self.ends, lo)
+        while cursor < hi:
+            nxt = self.starts[i] if i < len(self.starts) else hi
+            gap_end = min(nxt, hi)
+            if gap_end - cursor >= duration:
+                out.append((cursor, gap_end))
+            if i >= len(self.starts):
+                break
+            cursor = max(cursor, self.ends[i])
+            i += 1
+        return out
+
+class AvailabilityIndex:
+    """
+    Cache por artista de BusyIntervals, cargado con UNA consulta de rango.
+    Reservar / cancelar / rechazar invalidan la entrada; si una invalidación llega
+    mientras se carga, el resultado no se guarda (se sirve igual a quien lo pidió).
+    """
+    def __init__(self, ttl: float):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: dict[int, tuple[BusyIntervals, float]] = {}
+        self._generations: dict[int, int] = {}
+
+    def get(self, artist_id: int, lo: datetime, hi: datetime) -> BusyIntervals:
+        mono = time.monotonic()
+        with self._lock:
+            e = self._entries.get(artist_id)
+            if e and e[1] + self._ttl > mono and e[0].covers(lo, hi):
+                return e[0]
+            gen = self._generations.get(artist_id, 0)
+        busy = self._load(artist_id, lo, max(hi, lo + timedelta(days=AVAILABILITY_LOAD_DAYS)))
+        with self._lock:
+            if self._generations.get(artist_id, 0) == gen:
+                self._entries[artist_id] = (busy, mono)
+        return busy
+
+    def invalidate(self, artist_id: int):
+        with self._lock:
+            self._generations[artist_id] = self._generations.get(artist_id, 0) + 1
+            self._entries.pop(artist_id, None)
+
+    def _load(self, artist_id: int, lo: datetime, hi: datetime) -> BusyIntervals:
+        db = SessionLocal.session_factory()
+        try:
+            rows = (
+                db.query(Appointment.start_time, Appointment.end_time)
+                  .filter(
+                      Appointment.artist_id == artist_id,
+                      Appointment.status.notin_(FREE_APPT_STATUSES),
+                      Appointment.start_time < hi,
+                      Appointment.end_time > lo,
+                  )
+                  .all()
+            )
+            return BusyIntervals(lo, hi, [(s, e) for s, e in rows])
+        finally:
+            db.close()
+
+availability = AvailabilityIndex(AVAILABILITY_TTL)
+
+class BookingAdmission:
+    """
+    Admisión de reservas ordenada POR ARTISTA: comprobación de choque + insert en una
+    sola transacción, bajo un candado propio del artista (artistas distintos no se esperan).
+    - En el proceso: un threading.Lock por artista (se descarta cuando nadie lo usa).
+    - Entre procesos: SELECT ... FOR UPDATE sobre la fila del artista (Postgres). En SQLite
+      FOR UPDATE no existe y pysqlite no abre transacción antes de un SELECT, así que la
+      transacción se abre con BEGIN IMMEDIATE: el candado de escritor se toma ANTES de
+      check_overlap y los demás procesos esperan (busy_timeout) en vez de ver el tramo libre.
+    uq_artist_slot queda como red final: un IntegrityError también se rechaza.
+    """
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._locks: weakref.WeakValueDictionary[int, threading.Lock] = weakref.WeakValueDictionary()
+        self._admitted = 0
+        self._rejected = 0
+
+    def lock(self, artist_id: int) -> threading.Lock:
+        with self._guard:
+            lk = self._locks.get(artist_id)
+            if lk is None:
+                lk = threading.Lock()
+                self._locks[artist_id] = lk
+            return lk
+
+    def admit(self, db, appt: Appointment) -> bool:
+        """Inserta y confirma la cita si su tramo está libre; False (y rollback) si choca."""
+        with self.lock(appt.artist_id):
+            try:
+                self._lock_artist(db, appt.artist_id)
+                if check_overlap(db, appt.artist_id, appt.start_time, appt.end_time):
+                    db.rollback()
+                    ok = False
+                else:
+                    db.add(appt)
+                    db.commit()
+                    ok = True
+            except IntegrityError:
+                db.rollback()
+                ok = False
+        with self._guard:
+            if ok:
+                self._admitted += 1
+            else:
+                self._rejected += 1
+        if ok:
+            artist_stats.invalidate(appt.artist_id)
+            availability.invalidate(appt.artist_id)
+            http_cache.bump(("artist", appt.artist_id))
+        return ok
+
+    @staticmethod
+    def _lock_artist(db, artist_id: int):
+        """Candado entre procesos, tomado antes de comprobar el choque."""
+        if engine.dialect.name == "sqlite":
+            conn = db.connection(bind_arguments={"bind": engine})
+            # si la sesión ya escribió, pysqlite abrió la transacción y ya tiene el candado
+            if not conn.connection.dbapi_connection.in_transaction:
+                db.execute(sql_text("BEGIN IMMEDIATE"))
+        else:
+            db.query(User.id).filter(User.id == artist_id).with_for_update().one()
+
+    def stats(self) -> dict:
+        with self._guard:
+            return {"admitted": self._admitted, "rejected": self._rejected, "artists_locked": len(self._locks)}
+
+booking_admission = BookingAdmission()
+
+def find_double_bookings(db) -> list[tuple[int, int]]:
+    """Pares (id, id) de citas activas del mismo artista que se solapan. Debe estar vacío."""
+    a1, a2 = aliased(Appointment), aliased(Appointment)
+    return [
+        (x, y) for x, y in
+        db.query(a1.id, a2.id)
+          .join(a2, and_(a2.artist_id == a1.artist_id, a2.id > a1.id))
+          .filter(
+              a1.status.notin_(FREE_APPT_STATUSES),
+              a2.status.notin_(FREE_APPT_STATUSES),
+              a1.start_time < a2.end_time,
+              a2.start_time < a1.end_time,
+          )
+          .order_by(a1.id, a2.id)
+          .all()
+    ]
+
+@app.cli.command("check-double-bookings")
+def check_double_bookings_command():
+    """Lista citas activas solapadas (sólo lectura)."""
+    db = SessionLocal.session_factory()
+    try:
+        pairs = find_double_bookings(db)
+        for x, y in pairs:
+            print(f"solape: #{x} <-> #{y}")
+        print("ok" if not pairs else f"{len(pairs)} solapes")
+    finally:
+        db.close()
+
+def naive_dt(s: str) -> datetime:
+    """parse_dt normalizado a naive (las citas se guardan sin zona)."""
+    dt = parse_dt(s)
+    return dt.astimezone(timezone.utc).replace(tzinfo=None) if dt.tzinfo else dt
+
+@app.get("/artists/<int:artist_id>/availability")
+def artist_availability(artist_id: int):
+    """
+    ?from=ISO&to=ISO&duration=<min>
+    Huecos libres del artista (desde ahora como mínimo) donde cabe una sesión de `duration`.
+    Por defecto: desde ahora, 7 días, DEFAULT_APPT_MINUTES.
+    """
+    now = datetime.utcnow().replace(second=0, microsecond=0)
+    try:
+        lo = naive_dt(request.args["from"]) if request.args.get("from") else now
+        hi = naive_dt(request.args["to"]) if request.args.get("to") else lo + timedelta(days=7)
+    except ValueError:
+        return jsonify({"msg": "from/to inválidos (ISO 8601)"}), 400
+    minutes = request.args.get("duration", default=DEFAULT_APPT_MINUTES, type=int)
+    if not 0 < minutes <= AVAILABILITY_MAX_MINUTES:
+        return jsonify({"msg": f"duration debe estar entre 1 y {AVAILABILITY_MAX_MINUTES} minutos"}), 400
+    if hi <= lo:
+        return jsonify({"msg": "to debe ser posterior a from"}), 400
+    if hi - lo > timedelta(days=AVAILABILITY_MAX_DAYS):
+        return jsonify({"msg": f"Rango máximo: {AVAILABILITY_MAX_DAYS} días"}), 400
+
+    db = get_db()
+    try:
+        a = user_cache.get(artist_id, db)
+        if not a or a.role != "artist":
+            return jsonify({"msg": "Artista no encontrado"}), 404
+    finally:
+        db.close()
+
+    start = max(lo, now)
+    slots = availability.get(artist_id, start, hi).free_slots(start, hi, timedelta(minutes=minutes)) if start < hi else []
+    return jsonify({
+        "artist_id": artist_id,
+        "from": lo.isoformat(),
+        "to": hi.isoformat(),
+        "duration_minutes": minutes,
+        "slots": [{"start": s.isoformat(), "end": e.isoformat()} for s, e in slots],
+    })
 
 @app.post("/appointments")
 @role_required("client")
@@ -1421,15 +3968,12 @@ def book_appointment():
     db = get_db()
     try:
         design = db.get(Design, int(design_id))
-        artist = db.get(User, int(artist_id))
+        artist = user_cache.get(int(artist_id), db)
         if not design or not artist or artist.role != "artist":
             return jsonify({"msg": "Diseño o artista inválido"}), 400
         if design.artist_id != artist.id:
             return jsonify({"msg": "El diseño no pertenece a ese artista"}), 400
 
-        if check_overlap(db, artist.id, start_time, end_time):
-            return jsonify({"msg": "Horario no disponible"}), 409
-
         appt = Appointment(
             design_id=design.id,
             client_id=request.current_user.id,
@@ -1440,8 +3984,8 @@ def book_appointment():
             pay_now=pay_now,
             paid=False
         )
-        db.add(appt)
-        db.commit()
+        if not booking_admission.admit(db, appt):
+            return jsonify({"msg": "Horario no disponible"}), 409
 
         # 🔔 Notificación al tatuador
         try:
@@ -1464,77 +4008,130 @@ def book_appointment():
     finally:
         db.close()
 
-from sqlalchemy.orm import joinedload
-# ...
+APPOINTMENTS_PAGE_MAX = int(os.getenv("APPOINTMENTS_PAGE_MAX", "200"))
+
+APPOINTMENT_JSON = RowSerializer(
+    "id", "design_id", "artist_id", "client_id",
+    "start_time", "end_time",
+    "status",  # booked | canceled | done
+    "pay_now", "paid", "created_at",
+)
+
 @app.get("/appointments/me")
 @jwt_required()
 def my_appointments():
-    from flask_jwt_extended import get_jwt_identity
+    """
+    Citas del usuario (como cliente o artista), por start_time desc.
+    Query (todo opcional):
+      from / to      ventana ISO sobre start_time [from, to)
+      status         lista separada por comas (booked,confirmed,...)
+      order          desc (por defecto) | asc
+      limit, cursor  keyset sobre (start_time, id); siguiente página en X-Next-Cursor
+      compact=1      sin descripción ni URL del diseño
+    """
     db = get_db()
     try:
-        uid = int(get_jwt_identity())
-        user = db.get(User, uid)
+        user = current_user()
         if not user:
             return jsonify({"msg": "No autorizado"}), 401
 
+        try:
+            lo = naive_dt(request.args["from"]) if request.args.get("from") else None
+            hi = naive_dt(request.args["to"]) if request.args.get("to") else None
+        except ValueError:
+            return jsonify({"msg": "from/to inválidos (ISO 8601)"}), 400
+        statuses = [x.strip() for x in (request.args.get("status") or "").split(",") if x.strip()]
+        ascending = request.args.get("order", "desc") == "asc"
+        compact = request.args.get("compact", default=0, type=int) == 1
+        limit = request.args.get("limit", type=int)
+        try:
+            cursor = decode_cursor(request.args.get("cursor"))
+            if cursor:
+                cursor = (parse_dt(cursor[0]), int(cursor[1]))
+        except (ValueError, TypeError, IndexError):
+            return jsonify({"msg": "cursor inválido"}), 400
+
+        # Una consulta: cita + columnas del diseño + artista y cliente (el diseño es del artista de la cita)
+        artist_u, client_u = aliased(User), aliased(User)
+        design_cols = [Design.id, Design.title, Design.image_url, Design.price]
+        if not compact:
+            design_cols.append(Design.description)
         q = (
-            db.query(Appointment)
-              .options(
-                  joinedload(Appointment.design).joinedload(Design.artist),  # 👈 artista del diseño
-                  joinedload(Appointment.artist),
-                  joinedload(Appointment.client),
-              )
+            db.query(Appointment, artist_u, client_u, *design_cols)
+              .outerjoin(Design, Design.id == Appointment.design_id)
+              .outerjoin(artist_u, artist_u.id == Appointment.artist_id)
+              .outerjoin(client_u, client_u.id == Appointment.client_id)
         )
         if user.role == "client":
             q = q.filter(Appointment.client_id == user.id)
         else:
             q = q.filter(Appointment.artist_id == user.id)
-
-        appts = q.order_by(Appointment.start_time.desc()).all()
+        if lo:
+            q = q.filter(Appointment.start_time >= lo)
+        if hi:
+            q = q.filter(Appointment.start_time < hi)
+        if statuses:
+            q = q.filter(Appointment.status.in_(statuses))
+        if cursor:
+            if ascending:
+                q = q.filter(or_(
+                    Appointment.start_time > cursor[0],
+                    and_(Appointment.start_time == cursor[0], Appointment.id > cursor[1]),
+                ))
+            else:
+                q = q.filter(or_(
+                    Appointment.start_time < cursor[0],
+                    and_(Appointment.start_time == cursor[0], Appointment.id < cursor[1]),
+                ))
+        if ascending:
+            q = q.order_by(Appointment.start_time.asc(), Appointment.id.asc())
+        else:
+            q = q.order_by(Appointment.start_time.desc(), Appointment.id.desc())
 
         base = os.getenv("PUBLIC_BASE_URL", request.host_url.rstrip("/"))
 
-        out = []
-        for a in appts:
-            d = a.design
-            artist = a.artist
-            client = a.client
-            d_artist = d.artist if d and hasattr(d, "artist") else None
-
-            out.append({
-                "id": a.id,
-                "design_id": a.design_id,
-                "artist_id": a.artist_id,
-                "client_id": a.client_id,
-                "start_time": a.start_time.isoformat(),
-                "end_time": a.end_time.isoformat(),
-                "status": a.status,        # booked | canceled | done
-                "pay_now": a.pay_now,
-                "paid": a.paid,
-                "created_at": a.created_at.isoformat(),
-
+        def item(row):
+            a, artist, client, d_id, d_title, d_image_url, d_price, *rest = row
+            design = {
+                "id": d_id,
+                "title": d_title,
+                "image_url": d_image_url,
+                "artist_id": (a.artist_id if d_id else None),               # 👈 lo usa Detail
+                "artist_name": (artist.name if d_id and artist else None),  # 👈 nombre legible
+            }
+            if not compact:
+                design.update({
+                    "description": (rest[0] if d_id else None),             # 👈 NECESARIO
+                    "artist_avatar_url": (getattr(artist, "avatar_url", None) if d_id and artist else None),
+                    "url": (f"{base}/panel/designs/{d_id}" if d_id else None),
+                })
+            return APPOINTMENT_JSON(
+                a,
                 # === Enriquecido ===
-                "price": (d.price if d else None),
-                "design": {
-                    "id": (d.id if d else None),
-                    "title": (d.title if d else None),
-                    "image_url": (d.image_url if d else None),
-                    "description": (d.description if d else None),          # 👈 NECESARIO
-                    "artist_id": (d.artist_id if d else None),              # 👈 lo usa Detail
-                    "artist_name": (d_artist.name if d_artist else None),   # 👈 nombre legible
-                    "artist_avatar_url": (getattr(d_artist, "avatar_url", None) if d_artist else None),
-                    "url": (f"{base}/panel/designs/{d.id}" if d else None),
-                },
-                "artist": {
-                    "id": (artist.id if artist else None),
-                    "name": (artist.name if artist else None),
-                },
-                "client": {
-                    "id": (client.id if client else None),
-                    "name": (client.name if client else None),
-                },
-            })
-        return jsonify(out)
+                price=d_price,
+                design=design,
+                artist={"id": (artist.id if artist else None), "name": (artist.name if artist else None)},
+                client={"id": (client.id if client else None), "name": (client.name if client else None)},
+            )
+
+        if not limit:
+            # sin límite: se emite por lotes desde el cursor de la DB, con sesión propia
+            sdb = stream_session()
+            resp = json_stream(q.with_session(sdb).yield_per(JSON_STREAM_BATCH), item)
+            resp.call_on_close(sdb.close)
+            return resp
+
+        limit = max(1, min(limit, APPOINTMENTS_PAGE_MAX))
+        rows = q.limit(limit + 1).all()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1][0]
+            next_cursor = encode_cursor(last.start_time, last.id)
+        resp = jsonify([item(r) for r in rows])
+        if next_cursor:
+            resp.headers["X-Next-Cursor"] = next_cursor
+        return resp
     finally:
         db.close()
 
@@ -1556,6 +4153,7 @@ def mark_paid(appointment_id):
 
         appt.paid = True
         db.commit()
+        http_cache.bump(("appointment", appt.id))
 
         # 🔔 Notificación al tatuador
         try:
@@ -1589,6 +4187,9 @@ def cancel_appointment(appointment_id):
 
         appt.status = "canceled"
         db.commit()
+        artist_stats.invalidate(appt.artist_id)
+        availability.invalidate(appt.artist_id)
+        http_cache.bump(("appointment", appt.id), ("artist", appt.artist_id))
 
         # 🔔 Notificar a la contraparte
         try:
@@ -1618,6 +4219,7 @@ def cancel_appointment(appointment_id):
         db.close()
 
 @app.get("/appointments/<int:appointment_id>")
+@http_cached(lambda kw, uid: [("appointment", kw["appointment_id"]), "designs"])
 def get_appointment(appointment_id):
     db = get_db()
     try:
@@ -1685,6 +4287,7 @@ def payments_mercadopago():
             appt.paid = True
 
         db.commit()
+        http_cache.bump(("appointment", appt.id))
 
         # 🔔 Notificación al tatuador si aprobó
         if status == "approved":
@@ -0,0 +1,223 @@
+"""
+Modo ASGI: sirve los streams SSE como corrutinas y delega el resto a la app Flask.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 8000
+
+Un stream inactivo es sólo una corrutina esperando su suscripción del broker:
+no ocupa hilo ni sesión. La conexión a la DB se toma (en un hilo del pool)
+únicamente mientras se leen las filas nuevas. Mismos modelos, mismo JWT y
+mismo formato de eventos que /notifications/sse y /chat/threads/<id>/sse en app.py.
+
+El resto (la API REST) pasa a Flask con a2wsgi.WSGIMiddleware: cada request corre en
+un pool de ASGI_WSGI_WORKERS hilos (requests concurrentes, como con gunicorn --threads)
+y el cuerpo llega a Flask en streaming, así que el tope de /upload/image/stream corta
+al pasar UPLOAD_MAX_BYTES sin haber leído el resto. (asgiref.WsgiToAsgi no sirve aquí:
+corre todo en un único hilo y lee el cuerpo completo antes de llamar a la app.)
+"""
+import asyncio
+import os
+import re
+from urllib.parse import parse_qs
+
+from a2wsgi import WSGIMiddleware
+from flask_jwt_extended import decode_token
+
+from app import (
+    app, broker, init_db, SessionLocal, SSE_KEEPALIVE_SECONDS,
+    ChatThread, user_cache,
+    notifications_channel, chat_channel,
+    notifications_after, chat_messages_after, chat_last_message_id,
+    notification_payload, chat_message_payload, sse_event,
+)
+
+ASGI_WSGI_WORKERS = int(os.getenv("ASGI_WSGI_WORKERS", "16"))
+
+def _flask(environ, start_response):
+    # el servidor ASGI ya entrega el cuerpo des-chunkeado y marca su fin: sin esto werkzeug
+    # trata un upload sin Content-Length (Transfer-Encoding: chunked) como vacío
+    environ["wsgi.input_terminated"] = True
+    return app(environ, start_response)
+
+wsgi_app = WSGIMiddleware(_flask, workers=ASGI_WSGI_WORKERS)
+
+# =========================
+# Helpers
+# =========================
+def _read(fn, *args):
+    """Ejecuta una lectura con una sesión propia y de vida corta (en un hilo del pool)."""
+    db = SessionLocal.session_factory()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+async def read_db(fn, *args):
+    return await asyncio.to_thread(_read, fn, *args)
+
+def _query_args(scope) -> dict:
+    qs = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    return {k: v[-1] for k, v in qs.items()}
+
+def _int_arg(args: dict, name: str) -> int:
+    try:
+        return int(args.get(name) or 0)
+    except ValueError:
+        return 0
+
+def _identity(scope, args: dict) -> int | None:
+    """Valida el JWT (header Authorization o ?token=) igual que verify_jwt_in_request."""
+    token = None
+    for k, v in scope.get("headers", []):
+        if k == b"authorization":
+            auth = v.decode("latin-1")
+            if auth.lower().startswith("bearer "):
+                token = auth[7:].strip()
+            break
+    token = token or args.get("token")
+    if not token:
+        return None
+    try:
+        with app.app_context():
+            claims = decode_token(token)
+        if claims.get("type") != "access":
+            return None
+        return int(claims["sub"])
+    except Exception:
+        return None
+
+class SSEStream:
+    """Respuesta text/event-stream sobre ASGI con detección de desconexión."""
+    def __init__(self, receive, send):
+        self._receive = receive
+        self._send = send
+        self.disconnected = asyncio.Event()
+        self._watcher = None
+
+    async def start(self, on_disconnect=None):
+        await self._send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream; charset=utf-8"),
+                (b"cache-control", b"no-cache"),
+                (b"access-control-allow-origin", b"*"),
+            ],
+        })
+
+        async def watch():
+            while True:
+                msg = await self._receive()
+                if msg["type"] == "http.disconnect":
+                    self.disconnected.set()
+                    if on_disconnect:
+                        on_disconnect()
+                    return
+        self._watcher = asyncio.create_task(watch())
+
+    async def write(self, chunk: str):
+        await self._send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+
+    async def wait(self, sub) -> bool:
+        """Espera una publicación; emite keepalives mientras tanto. False si el cliente se fue."""
+        while not await sub.wait(SSE_KEEPALIVE_SECONDS):
+            if self.disconnected.is_set():
+                return False
+            await self.write(": keepalive\n\n")
+        return not self.disconnected.is_set()
+
+    async def close(self):
+        if self._watcher:
+            self._watcher.cancel()
+        if not self.disconnected.is_set():
+            await self._send({"type": "http.response.body", "body": b"", "more_body": False})
+
+# =========================
+# Streams
+# =========================
+async def notifications_sse(scope, receive, send):
+    args = _query_args(scope)
+    stream = SSEStream(receive, send)
+    uid = _identity(scope, args)
+    if uid is None:
+        await stream.start()
+        await stream.write("event: error\ndata: unauthorized\n\n")
+        return await stream.close()
+
+    last_id = _int_arg(args, "last_id")
+    sub = broker.subscribe_async(notifications_channel(uid))
+    await stream.start(on_disconnect=sub.notify)
+    try:
+        while True:
+            rows = await read_db(notifications_after, uid, last_id)
+            for r in rows:
+                await stream.write(sse_event("notification", notification_payload(r)))
+                last_id = r.id
+            if not await stream.wait(sub):
+                return
+    finally:
+        sub.close()
+        await stream.close()
+
+def _thread_access(db, uid: int, thread_id: int) -> bool:
+    me = user_cache.get(uid, db)
+    th = db.get(ChatThread, thread_id)
+    return bool(me and th and me.id in (th.artist_id, th.client_id))
+
+async def chat_sse(scope, receive, send, thread_id: int):
+    args = _query_args(scope)
+    stream = SSEStream(receive, send)
+    uid = _identity(scope, args)
+    if uid is None:
+        await stream.start()
+        await stream.write("event: error\ndata: unauthorized\n\n")
+        return await stream.close()
+    if not await read_db(_thread_access, uid, thread_id):
+        await stream.start()
+        await stream.write("event: error\ndata: forbidden\n\n")
+        return await stream.close()
+
+    sub = broker.subscribe_async(chat_channel(thread_id))
+    await stream.start(on_disconnect=sub.notify)
+    try:
+        last_id = _int_arg(args, "last_id")
+        if not last_id:
+            # arranca en el último para no reemitir histórico
+            last_id = await read_db(chat_last_message_id, thread_id)
+        while True:
+            msgs = await read_db(chat_messages_after, thread_id, last_id)
+            for m in msgs:
+                await stream.write(sse_event("message", chat_message_payload(m)))
+                last_id = m.id
+            if not await stream.wait(sub):
+                return
+    finally:
+        sub.close()
+        await stream.close()
+
+# =========================
+# Router
+# =========================
+SSE_ROUTES = [
+    (re.compile(r"^/notifications/sse/?$"), lambda scope, receive, send, m: notifications_sse(scope, receive, send)),
+    (re.compile(r"^/chat/threads/(\d+)/sse/?$"), lambda scope, receive, send, m: chat_sse(scope, receive, send, int(m.group(1)))),
+]
+
+async def _lifespan(receive, send):
+    while True:
+        msg = await receive()
+        if msg["type"] == "lifespan.startup":
+            await asyncio.to_thread(init_db)
+            await send({"type": "lifespan.startup.complete"})
+        elif msg["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] == "http" and scope["method"] == "GET":
+        for pattern, handler in SSE_ROUTES:
+            m = pattern.match(scope["path"])
+            if m:
+                return await handler(scope, receive, send, m)
+    return await wsgi_app(scope, receive, send)
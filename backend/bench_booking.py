@@ -0,0 +1,135 @@
+"""
+Prueba de concurrencia de reservas: muchos hilos reservando tramos solapados a la vez.
+
+    python bench_booking.py                  # 16 hilos, 2000 intentos, 4 artistas
+    python bench_booking.py --no-lock        # sin candado por artista (muestra la carrera)
+    python bench_booking.py --processes 8 --threads 32   # 8 procesos (como workers de gunicorn), mismo archivo
+
+Usa una base SQLite temporal (no toca tattoo.db) y termina con código 1 si
+find_double_bookings encuentra algún solape. Con --processes los hilos se reparten
+entre procesos hijos (spawn) que reservan contra el mismo archivo: ahí el candado
+en memoria no protege y la admisión depende sólo del candado de la base.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+# los procesos hijos heredan la ruta por el entorno y reservan contra la misma base
+if not os.environ.get("BENCH_BOOKING_DB"):
+    os.environ["BENCH_BOOKING_DB"] = os.path.join(tempfile.mkdtemp(prefix="bench_booking_"), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.environ['BENCH_BOOKING_DB']}"
+os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = ""
+os.environ.setdefault("FCM_SERVER_KEY", "")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app as A  # noqa: E402
+
+
+def login(client, email: str, role: str) -> tuple[int, dict]:
+    client.post("/auth/register", json={"email": email, "password": "bench", "role": role, "name": email.split("@")[0]})
+    j = client.post("/auth/login", json={"email": email, "password": "bench"}).get_json()
+    return j["user_id"], {"Authorization": f"Bearer {j['access_token']}"}
+
+
+def book(designs, clients, day, slots: int, attempts: int, threads: int, no_lock: bool):
+    """Corre `attempts` reservas con `threads` hilos en este proceso; (códigos, stats de admisión)."""
+    A.send_notification = lambda *a, **k: None  # fuera de la medición
+    if no_lock:
+        A.booking_admission.lock = lambda artist_id: threading.Lock()
+
+    counts: dict[int, int] = {}
+    lock = threading.Lock()
+    remaining = [attempts]
+
+    def worker():
+        c = A.app.test_client()
+        rnd = random.Random()
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            aid, did = rnd.choice(designs)
+            start = day + timedelta(minutes=15 * rnd.randrange(slots))
+            r = c.post("/appointments", headers=rnd.choice(clients), json={
+                "design_id": did, "artist_id": aid,
+                "start_time": start.isoformat(), "duration_minutes": rnd.choice((30, 60, 90, 120)),
+            })
+            with lock:
+                counts[r.status_code] = counts.get(r.status_code, 0) + 1
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return counts, A.booking_admission.stats()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--artists", type=int, default=4)
+    ap.add_argument("--clients", type=int, default=20)
+    ap.add_argument("--threads", type=int, default=16)
+    ap.add_argument("--processes", type=int, default=1, help="procesos que reservan a la vez (hilos repartidos)")
+    ap.add_argument("--attempts", type=int, default=2000)
+    ap.add_argument("--hours", type=int, default=12, help="ancho de la agenda disputada")
+    ap.add_argument("--no-lock", action="store_true")
+    args = ap.parse_args()
+
+    A.init_db()
+    setup = A.app.test_client()
+    designs = []
+    for i in range(args.artists):
+        aid, ah = login(setup, f"artist{i}@bench", "artist")
+        d = setup.post("/designs", json={"title": f"d{i}", "image_url": "http://x", "price": 1}, headers=ah).get_json()
+        designs.append((aid, d["id"]))
+    clients = [login(setup, f"client{i}@bench", "client")[1] for i in range(args.clients)]
+
+    day = (datetime.utcnow() + timedelta(days=1)).replace(hour=8, minute=0, second=0, microsecond=0)
+    slots = args.hours * 4  # pasos de 15 min
+    procs = max(1, args.processes)
+
+    t0 = time.perf_counter()
+    if procs == 1:
+        results = [book(designs, clients, day, slots, args.attempts, args.threads, args.no_lock)]
+    else:
+        jobs = [
+            (designs, clients, day, slots, args.attempts // procs + (i < args.attempts % procs),
+             max(1, args.threads // procs), args.no_lock)
+            for i in range(procs)
+        ]
+        with multiprocessing.get_context("spawn").Pool(procs) as pool:
+            results = pool.starmap(book, jobs)
+    elapsed = time.perf_counter() - t0
+
+    counts: dict[int, int] = {}
+    admission = {"admitted": 0, "rejected": 0}
+    for c, s in results:
+        for code, n in c.items():
+            counts[code] = counts.get(code, 0) + n
+        admission["admitted"] += s["admitted"]
+        admission["rejected"] += s["rejected"]
+
+    db = A.SessionLocal.session_factory()
+    try:
+        pairs = A.find_double_bookings(db)
+    finally:
+        db.close()
+
+    print(f"intentos: {args.attempts} en {elapsed:.2f}s ({args.attempts / elapsed:.0f}/s), "
+          f"procesos: {procs}, hilos: {args.threads}")
+    print(f"respuestas: {dict(sorted(counts.items()))}")
+    print(f"admisión: {admission}")
+    print(f"dobles reservas: {len(pairs)}")
+    sys.exit(1 if pairs else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Carga concurrente de lecturas y escrituras contra SQLite con cada perfil de runtime de la DB.
+
+    python bench_db.py                         # default vs tuned, 16 hilos, 10 s cada uno
+    python bench_db.py --threads 32 --seconds 20 --write-ratio 0.5
+
+Cada perfil corre en un proceso aparte (el engine se configura al importar app) sobre
+una base temporal nueva (no toca tattoo.db). Lecturas: /appointments/me, /notifications,
+/chat/threads/<id>/messages y /favorites/me (ninguna pasa por la cache HTTP).
+Escrituras: mensajes de chat (mensaje + resumen del hilo + notificación) y favoritos.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+PROFILES = ("default", "tuned")
+
+
+def run(args):
+    tmp = tempfile.mkdtemp(prefix="bench_db_")
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmp}/bench.db"
+    os.environ["DB_RUNTIME_PROFILE"] = args.profile
+    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = ""
+    os.environ.setdefault("FCM_SERVER_KEY", "")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as A
+
+    A.init_db()
+    setup = A.app.test_client()
+
+    def login(email: str, role: str) -> tuple[int, dict]:
+        setup.post("/auth/register", json={"email": email, "password": "bench", "role": role, "name": email.split("@")[0]})
+        j = setup.post("/auth/login", json={"email": email, "password": "bench"}).get_json()
+        return j["user_id"], {"Authorization": f"Bearer {j['access_token']}"}
+
+    artists = [login(f"artist{i}@bench", "artist") for i in range(4)]
+    designs = []
+    for aid, ah in artists:
+        for j in range(10):
+            r = setup.post("/designs", json={"title": f"d{aid}-{j}", "image_url": "http://x", "price": j}, headers=ah)
+            designs.append(r.get_json()["id"])
+    clients = []
+    for i in range(args.clients):
+        cid, ch = login(f"client{i}@bench", "client")
+        aid, _ = artists[i % len(artists)]
+        th = setup.post("/chat/threads/ensure", json={"other_user_id": aid}, headers=ch).get_json()["thread_id"]
+        for k in range(20):
+            setup.post(f"/chat/threads/{th}/messages", json={"text": f"semilla {k}"}, headers=ch)
+        clients.append((ch, th))
+
+    reads = [
+        lambda c, h, th: c.get("/appointments/me?limit=50", headers=h),
+        lambda c, h, th: c.get("/notifications?limit=50", headers=h),
+        lambda c, h, th: c.get(f"/chat/threads/{th}/messages?limit=50", headers=h),
+        lambda c, h, th: c.get("/favorites/me", headers=h),
+    ]
+
+    def write(c, h, th, rnd):
+        if rnd.random() < 0.5:
+            return c.post(f"/chat/threads/{th}/messages", json={"text": "hola"}, headers=h)
+        did = rnd.choice(designs)
+        if rnd.random() < 0.5:
+            return c.post(f"/designs/{did}/favorite", headers=h)
+        return c.delete(f"/designs/{did}/favorite", headers=h)
+
+    lock = threading.Lock()
+    stats = {"reads": [], "writes": [], "errors": 0}
+    deadline = time.perf_counter() + args.seconds
+
+    def worker(seed: int):
+        c = A.app.test_client()
+        rnd = random.Random(seed)
+        local = {"reads": [], "writes": [], "errors": 0}
+        while time.perf_counter() < deadline:
+            h, th = rnd.choice(clients)
+            kind = "writes" if rnd.random() < args.write_ratio else "reads"
+            t = time.perf_counter()
+            try:
+                r = write(c, h, th, rnd) if kind == "writes" else rnd.choice(reads)(c, h, th)
+                ok = r.status_code < 500
+            except Exception:
+                ok = False
+            if ok:
+                local[kind].append(time.perf_counter() - t)
+            else:
+                local["errors"] += 1
+        with lock:
+            stats["reads"] += local["reads"]
+            stats["writes"] += local["writes"]
+            stats["errors"] += local["errors"]
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    with A.engine.connect() as conn:
+        pragmas = {p: conn.exec_driver_sql(f"PRAGMA {p}").scalar()
+                   for p in ("journal_mode", "synchronous", "busy_timeout", "mmap_size", "cache_size")}
+
+    def pct(xs, q):
+        xs = sorted(xs)
+        return xs[min(len(xs) - 1, int(q * len(xs)))] * 1000 if xs else 0.0
+
+    print(json.dumps({
+        "profile": args.profile,
+        "pragmas": pragmas,
+        "reads_per_s": len(stats["reads"]) / elapsed,
+        "writes_per_s": len(stats["writes"]) / elapsed,
+        "read_p95_ms": pct(stats["reads"], 0.95),
+        "write_p95_ms": pct(stats["writes"], 0.95),
+        "errors": stats["errors"],
+    }))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--threads", type=int, default=16)
+    ap.add_argument("--seconds", type=float, default=10)
+    ap.add_argument("--clients", type=int, default=20)
+    ap.add_argument("--write-ratio", type=float, default=0.3)
+    ap.add_argument("--profile", choices=PROFILES, help="corre sólo este perfil (uso interno)")
+    args = ap.parse_args()
+
+    if args.profile:
+        return run(args)
+
+    results = []
+    for profile in PROFILES:
+        cmd = [sys.executable, os.path.abspath(__file__), "--profile", profile,
+               "--threads", str(args.threads), "--seconds", str(args.seconds),
+               "--clients", str(args.clients), "--write-ratio", str(args.write_ratio)]
+        out = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+
+    print(f"hilos: {args.threads}, {args.seconds:.0f} s por perfil, escrituras: {args.write_ratio:.0%}")
+    for r in results:
+        print(f"{r['profile']:>8}: lecturas {r['reads_per_s']:7.0f}/s (p95 {r['read_p95_ms']:6.1f} ms)  "
+              f"escrituras {r['writes_per_s']:6.0f}/s (p95 {r['write_p95_ms']:6.1f} ms)  errores {r['errors']}")
+        print(f"          {r['pragmas']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Comparativa de serialización: dicts a mano + .isoformat() + jsonify de Flask (camino
+anterior) contra RowSerializer + json_dumps (orjson) y json_stream.
+
+    python bench_json.py                  # 20000 citas / diseños, 5 repeticiones
+    python bench_json.py --rows 100000
+
+No usa la DB: serializa objetos de modelo en memoria (transitorios). Mide tiempo y
+pico de memoria (tracemalloc) por camino, y el costo por evento SSE del chat.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+_tmp = tempfile.mkdtemp(prefix="bench_json_")
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/bench.db"
+os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = ""
+os.environ.setdefault("FCM_SERVER_KEY", "")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+
+import app as A  # noqa: E402
+
+
+def make_rows(n: int):
+    t0 = datetime(2030, 1, 1, 10, 0, 0, 123456)
+    # URLs externas: variants() no toca el disco y se mide sólo la serialización
+    designs = [
+        A.Design(id=i, title=f"Diseño {i}", description="línea fina, sombra " * 3, image_url=f"https://cdn.example.com/{i}.png",
+                 price=50000 + i, artist_id=1 + i % 7, likes_count=i % 13, created_at=t0 - timedelta(minutes=i))
+        for i in range(n)
+    ]
+    appts = [
+        A.Appointment(id=i, design_id=i, artist_id=1 + i % 7, client_id=100 + i % 50, status="booked",
+                      start_time=t0 + timedelta(hours=i), end_time=t0 + timedelta(hours=i, minutes=90),
+                      pay_now=False, paid=bool(i % 2), created_at=t0)
+        for i in range(n)
+    ]
+    msgs = [A.ChatMessage(id=i, thread_id=1, sender_id=1 + i % 2, text=f"mensaje {i} 😀", image_url=None, created_at=t0)
+            for i in range(n)]
+    return designs, appts, msgs
+
+
+def legacy_design(d):
+    return {
+        "id": d.id,
+        "title": d.title,
+        "description": d.description,
+        "image_url": d.image_url,
+        **A.image_store.variants(d.image_url),
+        "price": d.price,
+        "artist_id": d.artist_id,
+        "artist_name": "artista",
+        "likes_count": int(d.likes_count or 0),
+        "is_favorited": False,
+        "created_at": d.created_at.isoformat(),
+    }
+
+
+def legacy_appointment(a):
+    return {
+        "id": a.id,
+        "design_id": a.design_id,
+        "artist_id": a.artist_id,
+        "client_id": a.client_id,
+        "start_time": a.start_time.isoformat(),
+        "end_time": a.end_time.isoformat(),
+        "status": a.status,
+        "pay_now": a.pay_now,
+        "paid": a.paid,
+        "created_at": a.created_at.isoformat(),
+    }
+
+
+def legacy_message(m):
+    return {
+        "id": m.id,
+        "sender_id": m.sender_id,
+        "text": m.text,
+        "image_url": m.image_url,
+        **A.image_store.variants(m.image_url),
+        "created_at": m.created_at.isoformat(),
+    }
+
+
+def measure(label: str, fn, repeat: int, rows: int):
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        size = fn()
+        best = min(best, time.perf_counter() - t)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  {label:<28} {best * 1000:8.1f} ms  {rows / best:10.0f} filas/s  pico {peak / 2**20:7.1f} MiB  {size / 2**20:6.1f} MiB")
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=20000)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--sse", type=int, default=5000, help="eventos SSE de chat")
+    args = ap.parse_args()
+
+    designs, appts, msgs = make_rows(args.rows)
+    legacy_json = DefaultJSONProvider(A.app)
+    print(f"backend: {'orjson ' + A.orjson.__version__ if A.orjson else 'json (stdlib)'}; filas: {args.rows}")
+
+    with A.app.test_request_context():
+        for name, rows, legacy, new in [
+            ("diseños", designs, legacy_design,
+             lambda d: A.DESIGN_JSON(d, artist_name="artista", is_favorited=False)),
+            ("citas", appts, legacy_appointment, A.APPOINTMENT_JSON),
+        ]:
+            print(name)
+            old = measure("dicts + jsonify (antes)", lambda: len(legacy_json.response([legacy(r) for r in rows]).get_data()),
+                          args.repeat, args.rows)
+            fast = measure("RowSerializer + jsonify", lambda: len(A.jsonify([new(r) for r in rows]).get_data()),
+                           args.repeat, args.rows)
+            measure("json_stream", lambda: sum(len(c) for c in A.json_stream(rows, new).response),
+                    args.repeat, args.rows)
+            print(f"  aceleración: x{old / fast:.1f}")
+
+        print(f"SSE chat ({args.sse} eventos)")
+        sample = msgs[:args.sse]
+
+        def sse_old():
+            return sum(len(f"event: message\ndata: {legacy_json.response(legacy_message(m)).get_data(as_text=True)}\n\n")
+                       for m in sample)
+
+        def sse_new():
+            return sum(len(A.sse_event("message", A.chat_message_payload(m))) for m in sample)
+
+        old = measure("jsonify().get_data (antes)", sse_old, args.repeat, len(sample))
+        fast = measure("sse_event", sse_new, args.repeat, len(sample))
+        print(f"  aceleración: x{old / fast:.1f}")
+
+
+if __name__ == "__main__":
+    main()
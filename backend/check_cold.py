@@ -0,0 +1,125 @@
+"""
+Chequeo de regresión del almacenamiento frío: las páginas de chat y notificaciones deben
+ser las mismas antes y después de archivar, también cuando el cursor cruza el borde
+caliente/frío y cuando frías y calientes se intercalan.
+
+    python check_cold.py
+
+Usa una base SQLite temporal (no toca tattoo.db). Siembra un hilo con 200 mensajes y
+archiva los ids 1..100; siembra 200 notificaciones, deja sin leer una de cada tres (siguen
+calientes, intercaladas con las leídas archivadas) y archiva. Compara cada página contra la
+respuesta previa al archivado y termina con código 1 si alguna difiere.
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+_tmp = tempfile.mkdtemp(prefix="check_cold_")
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/check.db"
+os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = ""
+os.environ.setdefault("FCM_SERVER_KEY", "")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app as A  # noqa: E402
+
+MESSAGES = 200
+ARCHIVED = 100  # ids 1..ARCHIVED del hilo pasan a frío
+NOTIFICATIONS = 200
+
+
+def login(client, email: str, role: str) -> tuple[int, dict]:
+    client.post("/auth/register", json={"email": email, "password": "check", "role": role, "name": email.split("@")[0]})
+    j = client.post("/auth/login", json={"email": email, "password": "check"}).get_json()
+    return j["user_id"], {"Authorization": f"Bearer {j['access_token']}"}
+
+
+def main():
+    A.init_db()
+    c = A.app.test_client()
+    aid, ah = login(c, "artist@check", "artist")
+    cid, ch = login(c, "client@check", "client")
+    th = c.post("/chat/threads/ensure", json={"other_user_id": aid}, headers=ch).get_json()["thread_id"]
+    for i in range(MESSAGES):
+        c.post(f"/chat/threads/{th}/messages", json={"text": f"m{i}"}, headers=ch if i % 2 else ah)
+
+    db = A.SessionLocal.session_factory()
+    try:
+        # las notificaciones de los mensajes quedan fuera: sólo las sembradas aquí
+        db.query(A.Notification).delete()
+        db.commit()
+        for i in range(NOTIFICATIONS):
+            A.send_notification(db, cid, "check", f"n{i}", "cuerpo", data={"i": i})
+        old = datetime.utcnow() - timedelta(days=max(A.CHAT_HOT_DAYS, A.NOTIFICATIONS_HOT_DAYS) + 1)
+        msg_ids = [m for (m,) in db.query(A.ChatMessage.id).filter(A.ChatMessage.thread_id == th).order_by(A.ChatMessage.id)]
+        db.query(A.ChatMessage).filter(A.ChatMessage.id.in_(msg_ids[:ARCHIVED])).update(
+            {A.ChatMessage.created_at: old, A.ChatMessage.seen_by_artist: True, A.ChatMessage.seen_by_client: True},
+            synchronize_session=False,
+        )
+        notif_ids = [n for (n,) in db.query(A.Notification.id).filter(A.Notification.user_id == cid).order_by(A.Notification.id)]
+        db.query(A.Notification).filter(A.Notification.user_id == cid).update(
+            {A.Notification.created_at: old}, synchronize_session=False)
+        db.query(A.Notification).filter(A.Notification.id.in_(notif_ids[1::3] + notif_ids[2::3])).update(
+            {A.Notification.read: True}, synchronize_session=False)
+        db.commit()
+
+        first, boundary = msg_ids[0], msg_ids[ARCHIVED]  # primer id caliente del hilo
+        chat_queries = [{"limit": 50}, {"limit": 50, "after_id": first + 19}]
+        chat_queries += [{"limit": n, "after_id": boundary - k} for n in (1, 7, 50) for k in (1, 3, 30)]
+        chat_queries += [{"limit": n, "before_id": boundary + k} for n in (1, 7, 50) for k in (1, 3, 30)]
+        chat_queries += [{"limit": 50, "before_id": msg_ids[-1] + 1}]
+        notif_queries = [{"limit": n} for n in (1, 7, 50)]
+        notif_queries += [{"limit": n, "before_id": b} for n in (1, 7, 50) for b in notif_ids[10::37]]
+
+        def chat(qs):
+            return c.get(f"/chat/threads/{th}/messages", headers=ch, query_string=qs).get_json()
+
+        def notifs(qs):
+            return c.get("/notifications", headers=ch, query_string=qs).get_json()
+
+        def walk(fetch, key, limit):
+            """Recorre todo con el cursor de la página anterior; lista de ids."""
+            seen, qs = [], {"limit": limit}
+            while True:
+                page = fetch(qs)
+                if not page:
+                    return seen
+                seen += [r["id"] for r in page]
+                qs = {"limit": limit, key: page[-1]["id"] if key == "after_id" else min(r["id"] for r in page)}
+
+        def snapshot():
+            return {
+                "chat": [chat(q) for q in chat_queries],
+                "notifications": [notifs(q) for q in notif_queries],
+                "chat_forward": {n: walk(chat, "after_id", n) for n in (7, 50)},
+                "notifications_back": {n: walk(notifs, "before_id", n) for n in (7, 50)},
+            }
+
+        before = snapshot()
+        A.COLD_SEGMENT_ROWS = 16  # varios segmentos por dueño
+        moved = A.archive_cold(db)
+        hot = db.query(A.ChatMessage).filter(A.ChatMessage.thread_id == th).count()
+    finally:
+        db.close()
+    after = snapshot()
+
+    # en frío sólo hay leídas: "read" de las archivadas es igual antes y después
+    failures = 0
+    for name, queries in (("chat", chat_queries), ("notifications", notif_queries)):
+        for q, b, a in zip(queries, before[name], after[name]):
+            if b != a:
+                failures += 1
+                print(f"DIFERENTE {name} {q}: antes {[r['id'] for r in b]} después {[r['id'] for r in a]}")
+    for name in ("chat_forward", "notifications_back"):
+        for n, ids in before[name].items():
+            if after[name][n] != ids:
+                failures += 1
+                print(f"DIFERENTE {name} limit={n}: {len(ids)} antes, {len(after[name][n])} después")
+
+    print(f"archivado: {moved}; mensajes calientes en el hilo: {hot}")
+    print(f"páginas comparadas: {len(chat_queries) + len(notif_queries)} + 4 recorridos; diferencias: {failures}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""
+Derivados de imágenes (miniatura / mediana) para el almacén de app.py.
+
+Se ejecuta dentro de un pool de procesos ("spawn"): este módulo sólo importa Pillow,
+así los procesos hijos no cargan la app, la DB ni los clientes salientes.
+"""
+import os
+
+from PIL import Image, ImageOps
+
+
+def variant_filename(name: str, variant: str) -> str:
+    return f"{name}.{variant}.webp"
+
+
+def make_variants(src: str, out_dir: str, name: str, sizes: dict[str, int]) -> dict[str, int]:
+    """
+    Genera un WEBP por variante (lado mayor <= sizes[variant]) en out_dir.
+    Escribe a un temporal y renombra, para que nunca se sirva un archivo a medias.
+    Devuelve {variant: bytes}.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    out = {}
+    with Image.open(src) as im:
+        im = ImageOps.exif_transpose(im)
+        has_alpha = im.mode in ("RGBA", "LA") or (im.mode == "P" and "transparency" in im.info)
+        im = im.convert("RGBA" if has_alpha else "RGB")
+        for variant, side in sorted(sizes.items(), key=lambda kv: -kv[1]):
+            copy = im.copy()
+            copy.thumbnail((side, side), Image.LANCZOS)
+            dst = os.path.join(out_dir, variant_filename(name, variant))
+            tmp = f"{dst}.{os.getpid()}.tmp"
+            copy.save(tmp, "WEBP", quality=80, method=4)
+            os.replace(tmp, dst)
+            out[variant] = os.path.getsize(dst)
+    return out